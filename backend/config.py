@@ -1,8 +1,15 @@
 import yaml
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from pydantic import BaseModel, Field
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+
+# libyaml's C loader is several times faster than the pure-Python one
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
 
 # Load variables from .env file into os.environ
 load_dotenv()
@@ -21,6 +28,12 @@ class ChromaSettings(BaseModel):
 class ModelSettings(BaseModel):
     bert: str
     qwen: str
+    # Model keys loaded (and warmed up) by EmbeddingService.preload() at startup
+    preload: List[str] = Field(default_factory=list)
+    # Forward passes allowed to run at once across threads (bounds VRAM use)
+    gpu_concurrency: int = Field(default=1, ge=1)
+    # SQLite file persisting query embeddings across runs; None keeps them in memory only
+    query_cache_path: Optional[str] = None
 
 
 class Config(BaseModel):
@@ -30,11 +43,12 @@ class Config(BaseModel):
     semantic_scholar_api_key: Optional[str] = Field(default=None)
 
 
+@lru_cache(maxsize=1)
 def load_config(config_path: str = "config.yaml") -> Config:
     try:
         # 1. Load from YAML
         with open(config_path, "r") as f:
-            raw_config = yaml.safe_load(f)
+            raw_config = yaml.load(f, Loader=SafeLoader)
 
         # 2. Load Secrets from Environment (now populated by .env)
         raw_config["semantic_scholar_api_key"] = os.getenv("SEMANTIC_SCHOLAR_API_KEY")
@@ -47,4 +61,6 @@ def load_config(config_path: str = "config.yaml") -> Config:
         raise RuntimeError(f"❌ Error loading config: {e}")
 
 
-settings = load_config()
\ No newline at end of file
+def get_settings() -> Config:
+    """Returns the parsed config, loading it on first use."""
+    return load_config()
@@ -1,19 +1,175 @@
-from backend.config import settings  # Import settings
+import asyncio
+import hashlib
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from functools import partial
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from backend.config import get_settings
 from embeddingModels.ModernBertEmbedder import ModernBertEmbedder
 from embeddingModels.QwenEmbedder import QwenEmbedder
 
 
+class QueryBatcher:
+    """
+    Coalesces concurrent single-text encode calls into one forward pass.
+
+    Callers block in submit(); a background thread waits up to max_wait_ms after
+    the first request (or until max_batch requests are queued) and encodes
+    everything that arrived in a single batch per model.
+    """
+
+    def __init__(self, embed_service: "EmbeddingService", max_batch: int = 32, max_wait_ms: float = 8.0):
+        self._embed_service = embed_service
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="QueryBatcher", daemon=True)
+        self._worker.start()
+
+    def enqueue(self, text: str, model_name: str = "bert") -> Future:
+        """Queues a single text and returns a Future for its embedding without blocking."""
+        future = Future()
+        self._queue.put((model_name, text, future))
+        return future
+
+    def submit(self, text: str, model_name: str = "bert") -> np.ndarray:
+        """Queues a single text and blocks until its embedding is ready."""
+        return self.enqueue(text, model_name=model_name).result()
+
+    async def submit_async(self, text: str, model_name: str = "bert") -> np.ndarray:
+        """Queues a single text and awaits its embedding without blocking the event loop."""
+        return await asyncio.wrap_future(self.enqueue(text, model_name=model_name))
+
+    def _run(self):
+        while True:
+            # 1. Block for the first request, then collect until the window closes
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # 2. One forward pass per model, then scatter rows back to the callers
+            by_model = defaultdict(list)
+            for model_name, text, future in pending:
+                by_model[model_name].append((text, future))
+
+            for model_name, items in by_model.items():
+                try:
+                    vectors = self._embed_service.encode([text for text, _ in items], model_name=model_name)
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+
+                for (_, future), vector in zip(items, vectors):
+                    # Rows may be handed to several callers (see EmbeddingService), so freeze them
+                    vector.setflags(write=False)
+                    future.set_result(vector)
+
+
+class QueryEmbeddingStore:
+    """
+    SQLite table of query embeddings that survives restarts, keyed by the embedding
+    model's name and the SHA-256 of the text. Vectors are stored as raw bytes in
+    the dtype the model produced, so a hit returns exactly what a fresh encode would.
+    Safe to share across threads.
+    """
+
+    def __init__(self, path: str):
+        path = Path(path).expanduser()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings "
+                "(model TEXT, key TEXT, dtype TEXT, vector BLOB, PRIMARY KEY (model, key))"
+            )
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT dtype, vector FROM query_embeddings WHERE model = ? AND key = ?",
+                (model, self._key(text))
+            ).fetchone()
+        if row is None:
+            return None
+        # frombuffer over the immutable blob is already read-only
+        return np.frombuffer(row[1], dtype=row[0])
+
+    def put(self, model: str, text: str, vector: np.ndarray):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embeddings VALUES (?, ?, ?, ?)",
+                (model, self._key(text), vector.dtype.str, vector.tobytes())
+            )
+
+
 class EmbeddingService:
-    def __init__(self):
+    QUERY_CACHE_SIZE = 1024
+
+    def __init__(self, max_concurrent_encodes: Optional[int] = None, query_cache_path: Optional[str] = None):
+        """
+        Args:
+            max_concurrent_encodes: How many forward passes may run at once across
+                threads (e.g. a bulk ingest next to query traffic). Each one holds
+                its own activations on the device, so this bounds peak VRAM.
+                Defaults to models.gpu_concurrency from the config.
+            query_cache_path: SQLite file persisting query embeddings across runs (see
+                QueryEmbeddingStore). Defaults to models.query_cache_path; when that is
+                unset too, query embeddings are only cached in memory.
+        """
+        settings = get_settings()
+        if max_concurrent_encodes is None:
+            max_concurrent_encodes = settings.models.gpu_concurrency
+        if query_cache_path is None:
+            query_cache_path = settings.models.query_cache_path
+
         self._models = {}
+        # One lock per model key, so concurrent first calls construct each model once
+        self._load_locks = defaultdict(threading.Lock)
+        self._encode_slots = threading.BoundedSemaphore(max_concurrent_encodes)
+        self._query_batcher = QueryBatcher(self)
+        # LRU of the batcher Future per (model_name, text): repeated questions skip the
+        # forward pass, and identical questions already in flight share one encode.
+        self._query_futures: "OrderedDict[Tuple[str, str], Future]" = OrderedDict()
+        self._query_futures_lock = threading.Lock()
+        self._query_store = QueryEmbeddingStore(query_cache_path) if query_cache_path else None
 
     def load_model(self, model_key: str):
+        # Fast path without locking once the model is loaded
         if model_key in self._models:
             return self._models[model_key]
 
+        with self._load_locks[model_key]:
+            # Another thread may have finished loading while we waited
+            if model_key in self._models:
+                return self._models[model_key]
+            return self._load_model_locked(model_key)
+
+    def _load_model_locked(self, model_key: str):
         print(f"Loading Model Key: {model_key}...")
 
         # USE CONFIG HERE
+        settings = get_settings()
         if model_key == "bert":
             self._models[model_key] = ModernBertEmbedder(
                 model_name=settings.models.bert,
@@ -29,6 +185,76 @@ class EmbeddingService:
 
         return self._models[model_key]
 
+    def preload(self, model_keys: Optional[List[str]] = None):
+        """
+        Loads models ahead of the first request so no caller pays the cold start.
+        Call it from the entry point right after construction (construction itself loads
+        nothing). Defaults to the keys listed under models.preload in the config; loading
+        already runs a CUDA warm-up encode for each model.
+        """
+        if model_keys is None:
+            model_keys = get_settings().models.preload
+
+        for model_key in model_keys:
+            self.load_model(model_key)
+
     def encode(self, text_list: list, model_name: str = "bert"):
         model = self.load_model(model_name)
-        return model.encode(text_list)
+        with self._encode_slots:
+            return model.encode(text_list)
+
+    def encode_query(self, text: str, model_name: str = "bert") -> np.ndarray:
+        """
+        Encodes a single query through the shared QueryBatcher, so concurrent
+        callers are served by one batched forward pass. Results are LRU-cached
+        per (model_name, text). Returns a read-only 1-D vector.
+        """
+        return self._cached_query(model_name, text).result()
+
+    async def aencode_query(self, text: str, model_name: str = "bert") -> np.ndarray:
+        """Async variant of encode_query(); awaits the batcher instead of blocking a thread."""
+        return await asyncio.wrap_future(self._cached_query(model_name, text))
+
+    def _cached_query(self, model_name: str, text: str) -> Future:
+        key = (model_name, text)
+        with self._query_futures_lock:
+            future = self._query_futures.get(key)
+            if future is not None:
+                self._query_futures.move_to_end(key)
+                return future
+
+            future = self._enqueue_query(model_name, text)
+            self._query_futures[key] = future
+            if len(self._query_futures) > self.QUERY_CACHE_SIZE:
+                self._query_futures.popitem(last=False)
+
+        # Outside the lock: the callback runs right away if the future already failed
+        future.add_done_callback(partial(self._evict_failed_query, key))
+        return future
+
+    def _enqueue_query(self, model_name: str, text: str) -> Future:
+        if self._query_store is not None:
+            # Keyed on the configured checkpoint, so changing the model in the config
+            # never serves vectors from the old one
+            store_model = getattr(get_settings().models, model_name, model_name)
+            vector = self._query_store.get(store_model, text)
+            if vector is not None:
+                future = Future()
+                future.set_result(vector)
+                return future
+
+        future = self._query_batcher.enqueue(text, model_name=model_name)
+        if self._query_store is not None:
+            future.add_done_callback(partial(self._persist_query, store_model, text))
+        return future
+
+    def _persist_query(self, store_model: str, text: str, future: Future):
+        if future.exception() is None:
+            self._query_store.put(store_model, text, future.result())
+
+    def _evict_failed_query(self, key: Tuple[str, str], future: Future):
+        # Drop only the failed entry (if it was not replaced meanwhile), so the next call retries it
+        if future.exception() is not None:
+            with self._query_futures_lock:
+                if self._query_futures.get(key) is future:
+                    del self._query_futures[key]
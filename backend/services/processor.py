@@ -10,4 +10,17 @@ class PDFProcessorService:
         Delegates processing to the DoclingPDFProcessor.
         """
         metadata, sections = self.processor.process_pdf(file_path)
+        return metadata, sections
+
+    def process_pdfs(self, file_paths: list):
+        """
+        Delegates batch processing to the DoclingPDFProcessor; yields (file_path, metadata, sections).
+        """
+        return self.processor.process_pdfs(file_paths)
+
+    def process_bytes(self, data: bytes, filename: str = "document.pdf"):
+        """
+        Delegates in-memory processing (no temporary file) to the DoclingPDFProcessor.
+        """
+        metadata, sections = self.processor.process_bytes(data, filename=filename)
         return metadata, sections
\ No newline at end of file
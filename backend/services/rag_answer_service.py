@@ -1,4 +1,5 @@
-from typing import List, Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 from langchain_core.documents import Document
 
@@ -15,29 +16,67 @@ class ChromaRagRetriever(BaseRetriever):
         self._embed_service = embed_service
         self._db_service = db_service
         self._model_name = model_name
+        # Keyed on the collection version too, so any write to the collection
+        # makes older entries unreachable (they age out of the LRU)
+        self._cached_retrieve = lru_cache(maxsize=512)(self._retrieve)
+
+    @property
+    def db_service(self) -> VectorDBService:
+        return self._db_service
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
 
     def get_relevant_documents(self, query: str, k: int = 4) -> List[Document]:
-        # Encode the query using the same embedding service used by /query.
-        query_vec_np = self._embed_service.encode([query], model_name=self._model_name)
+        # Repeated questions (evaluation re-runs, show_llm_prompt after query_rag) skip the search
+        version = self._db_service.version(self._model_name)
+        return list(self._cached_retrieve(query, k, version))
+
+    def _retrieve(self, query: str, k: int, version: int) -> Tuple[Document, ...]:
+        # Encode the query through the batcher so concurrent retrievals share a forward pass.
+        query_vec_np = self._embed_service.encode_query(query, model_name=self._model_name)
         # Query Chroma for the top-k most similar chunks.
         results = self._db_service.query(
             model_key=self._model_name,
-            query_embedding=query_vec_np[0].tolist(),
+            query_embedding=query_vec_np,
+            n_results=k
+        )
+
+        return tuple(self._to_documents(results))
+
+    async def aget_relevant_documents(self, query: str, k: int = 4) -> List[Document]:
+        # Awaits the query batcher and the vector DB directly, so no worker thread is held per request
+        query_vec_np = await self._embed_service.aencode_query(query, model_name=self._model_name)
+        results = await self._db_service.aquery(
+            model_key=self._model_name,
+            query_embedding=query_vec_np,
             n_results=k
         )
+        return self._to_documents(results)
+
+    def get_relevant_documents_batch(self, queries: List[str], k: int = 4) -> List[List[Document]]:
+        """Retrieves for several queries with one encode call and one vector-DB query."""
+        if not queries:
+            return []
 
-        ids = results.get("ids", [[]])[0] if results else []
-        documents = results.get("documents", [[]])[0] if results else []
-        metadatas = results.get("metadatas", [[]])[0] if results else []
-        distances = results.get("distances", [[]])[0] if results else []
-
-        docs: List[Document] = []
-        for doc_id, text, meta, score in zip(ids, documents, metadatas, distances):
-            meta_dict = dict(meta) if meta else {}
-            meta_dict["score"] = score
-            meta_dict["id"] = doc_id
-            docs.append(Document(page_content=text, metadata=meta_dict))
-        return docs
+        query_vecs = self._embed_service.encode(queries, model_name=self._model_name)
+        results = self._db_service.query_batch(self._model_name, query_vecs, n_results=k)
+        return [self._to_documents(results, row) for row in range(len(queries))]
+
+    @staticmethod
+    def _to_documents(results, row: int = 0) -> List[Document]:
+        if not results:
+            return []
+
+        # Unpack this query's columns once, then build all Documents in one pass
+        ids, documents, metadatas, distances = (
+            results.get(key, [[]])[row] for key in ("ids", "documents", "metadatas", "distances")
+        )
+        return [
+            Document(page_content=text, metadata={**(meta or {}), "score": score, "id": doc_id})
+            for doc_id, text, meta, score in zip(ids, documents, metadatas, distances)
+        ]
 
 
 def run_rag_answer(
@@ -1,10 +1,74 @@
+import hashlib
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import List, Dict, Any, Optional, Set, Tuple
 
+import numpy as np
 import pandas as pd
+import torch
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+
+
+class CachedEncoder:
+    """
+    Wraps SentenceTransformer.encode with a cache of embeddings keyed by the
+    SHA-256 of the text. With a cache_path the cache is persisted as a single
+    .npz file, so repeated evaluation runs only encode texts they have not seen.
+    The cache assumes the same encode options on every call (the evaluator
+    always asks for normalized vectors).
+    """
+
+    def __init__(self, model: SentenceTransformer, model_name: str, cache_path: Optional[str] = None):
+        self.model = model
+        self.model_name = model_name
+        self.cache_path = Path(cache_path) if cache_path else None
+        self._cache: Dict[str, np.ndarray] = {}
+        self._load()
+
+    def _load(self):
+        if self.cache_path is None or not self.cache_path.exists():
+            return
+
+        try:
+            with np.load(self.cache_path) as data:
+                # Vectors from a different model are not comparable; start over
+                if str(data["model_name"]) != self.model_name:
+                    print(f"Embedding cache {self.cache_path} belongs to another model, ignoring it.")
+                    return
+                self._cache = dict(zip(data["keys"].tolist(), data["vectors"]))
+            print(f"Loaded {len(self._cache)} cached embeddings from {self.cache_path}")
+        except Exception as e:
+            print(f"Error reading embedding cache {self.cache_path}: {e}")
+
+    def _save(self):
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write next to the target and swap, so an interrupted run never leaves a torn file
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                model_name=np.array(self.model_name),
+                keys=np.array(list(self._cache.keys())),
+                vectors=np.stack(list(self._cache.values()))
+            )
+        os.replace(tmp_path, self.cache_path)
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Encodes only the texts missing from the cache (in one call) and returns all rows in order."""
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        missing = [i for i, key in enumerate(keys) if key not in self._cache]
+
+        if missing:
+            vectors = self.model.encode([texts[i] for i in missing], **kwargs)
+            for i, vector in zip(missing, vectors):
+                self._cache[keys[i]] = np.asarray(vector, dtype=np.float32)
+            if self.cache_path is not None:
+                self._save()
+
+        return np.stack([self._cache[key] for key in keys])
 
 
 class EnhancedRAGEvaluator:
@@ -13,7 +77,22 @@ class EnhancedRAGEvaluator:
     including chunk retrieval, paper recall, and semantic answer quality.
     """
 
-    def __init__(self, pipeline: Any, model_name: str = 'all-MiniLM-L6-v2'):
+    ENCODE_KWARGS = {"batch_size": 64, "convert_to_numpy": True, "normalize_embeddings": True}
+    ENCODE_CHUNK_SIZE = 64
+
+    def __init__(
+            self,
+            pipeline: Any,
+            model_name: str = 'all-MiniLM-L6-v2',
+            cache_path: Optional[str] = None,
+            use_fp16: bool = False
+    ):
+        """
+        Args:
+            cache_path: Optional .npz file for persisting similarity-model embeddings across runs.
+            use_fp16: Run the similarity model in half precision on CUDA. Faster, but the
+                reported similarities can differ from fp32 runs in the third decimal.
+        """
         self.pipeline = pipeline
         self.results: List[Dict[str, Any]] = []
 
@@ -25,13 +104,25 @@ class EnhancedRAGEvaluator:
             print(f"Error loading model: {e}")
             raise
 
-    def evaluate(self, dataset: List[Dict[str, Any]], top_k: int = 5) -> pd.DataFrame:
+        # Half-precision matmuls only pay off on GPU; CPU stays in fp32
+        cache_tag = model_name
+        if use_fp16 and torch.cuda.is_available():
+            self.semantic_model = self.semantic_model.to("cuda").half()
+            cache_tag = f"{model_name}:fp16"
+
+        # fp16 and fp32 vectors differ slightly, so they are cached separately
+        self.encoder = CachedEncoder(self.semantic_model, cache_tag, cache_path=cache_path)
+
+    def evaluate(self, dataset: List[Dict[str, Any]], top_k: int = 5, max_concurrency: int = 1) -> pd.DataFrame:
         """
         Main entry point to evaluate a dataset against the RAG pipeline.
 
         Args:
             dataset: List of dictionaries containing questions and ground truths.
             top_k: Number of contexts to retrieve.
+            max_concurrency: Pipeline runs in flight at once. Above 1 the LLM and
+                embedding round-trips overlap; the per-question Latency then also
+                includes time spent queued behind the other requests.
 
         Returns:
             pd.DataFrame containing detailed evaluation metrics.
@@ -39,15 +130,123 @@ class EnhancedRAGEvaluator:
         print(f"Starting evaluation of {len(dataset)} questions...")
         self.results = []
 
-        for item in tqdm(dataset):
-            result = self._process_single_item(item, top_k)
+        # 1. Run the pipeline for every question (map keeps the dataset order)
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            runs = list(tqdm(
+                executor.map(lambda item: self._run_pipeline(item, top_k), dataset),
+                total=len(dataset)
+            ))
+
+        # 2. Fetch the expected chunks of all missed exact matches in one DB call;
+        #    only those need the expected text for the semantic check
+        missed = [
+            (item['expected_chunk_id'], run) for item, run in zip(dataset, runs)
+            if run is not None and item.get('expected_chunk_id') and run["exact_rank"] is None
+        ]
+        chunk_texts = self._fetch_chunk_texts(list({chunk_id for chunk_id, _ in missed}))
+        for chunk_id, run in missed:
+            run["expected_text"] = chunk_texts.get(chunk_id)
+
+        # 3. Embed every text the metrics need in one batched encode
+        embeddings = self._embed_texts(self._collect_texts(dataset, runs))
+
+        # 4. Score each question against the precomputed embeddings
+        for item, run in zip(dataset, runs):
+            result = self._process_single_item(item, run, embeddings)
             self.results.append(result)
 
         return pd.DataFrame(self.results)
 
-    def _process_single_item(self, item: Dict[str, Any], top_k: int) -> Dict[str, Any]:
+    def _run_pipeline(self, item: Dict[str, Any], top_k: int) -> Optional[Dict[str, Any]]:
+        """
+        Runs the pipeline for one item. Returns None if it fails, so the item
+        falls back to the default (error) result row.
+        """
+        question = item['question']
+        start_time = time.time()
+        try:
+            response = self.pipeline.run(question, k=top_k, include_sources=True)
+        except Exception as e:
+            print(f"Error evaluating question '{self._truncate_text(question, 30)}': {e}")
+            return None
+
+        return {
+            "response": response,
+            "elapsed": time.time() - start_time,
+            "exact_rank": self._find_exact_match(item.get('expected_chunk_id'), response.sources),
+            "expected_text": None  # filled in by evaluate() for missed exact matches
+        }
+
+    def _fetch_chunk_texts(self, chunk_ids: List[str]) -> Dict[str, str]:
+        """Retrieves the stored texts of several chunks with a single collection.get."""
+        if not chunk_ids:
+            return {}
+
+        try:
+            collection = self.pipeline.retriever.db_service.get_collection(
+                self.pipeline.retriever.model_name
+            )
+            docs = collection.get(ids=chunk_ids, include=["documents"])
+            return dict(zip(docs['ids'], docs['documents']))
+        except Exception:
+            # If we can't fetch the expected chunks from DB, we skip the semantic check
+            return {}
+
+    @staticmethod
+    def _collect_texts(dataset: List[Dict[str, Any]], runs: List[Optional[Dict[str, Any]]]) -> List[str]:
+        """Gathers every text that _process_single_item will look up an embedding for."""
+        texts = []
+        for item, run in zip(dataset, runs):
+            if run is None:
+                continue
+
+            if run["expected_text"]:
+                texts.append(run["expected_text"])
+                texts.extend(src.page_content for src in run["response"].sources)
+
+            if item.get('expected_answer') and run["response"].answer:
+                texts.append(item['expected_answer'])
+                texts.append(run["response"].answer)
+        return texts
+
+    def _embed_texts(self, texts: List[str]) -> Dict[str, np.ndarray]:
         """
-        Processes a single evaluation item: runs pipeline, calculates metrics, handles errors.
+        Encodes the distinct texts in one call. Vectors are L2-normalized,
+        so cosine similarity is a plain dot product. Texts that cannot be
+        encoded are left out, and their similarities are reported as None.
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        if not unique_texts:
+            return {}
+
+        try:
+            vectors = self.encoder.encode(unique_texts, show_progress_bar=True, **self.ENCODE_KWARGS)
+        except Exception as e:
+            print(f"Similarity encoding failed ({e}), retrying in chunks of {self.ENCODE_CHUNK_SIZE}...")
+            return self._embed_in_chunks(unique_texts)
+        return dict(zip(unique_texts, vectors))
+
+    def _embed_in_chunks(self, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Fallback for _embed_texts: a failing chunk only loses its own texts."""
+        embeddings = {}
+        for start in range(0, len(texts), self.ENCODE_CHUNK_SIZE):
+            chunk = texts[start:start + self.ENCODE_CHUNK_SIZE]
+            try:
+                vectors = self.encoder.encode(chunk, show_progress_bar=False, **self.ENCODE_KWARGS)
+            except Exception as e:
+                print(f"Error encoding {len(chunk)} texts for similarity, skipping them: {e}")
+                continue
+            embeddings.update(zip(chunk, vectors))
+        return embeddings
+
+    def _process_single_item(
+            self,
+            item: Dict[str, Any],
+            run: Optional[Dict[str, Any]],
+            embeddings: Dict[str, np.ndarray]
+    ) -> Dict[str, Any]:
+        """
+        Builds the result row for a single evaluation item from its pipeline run.
         """
         question = item['question']
         target_tag = item.get('target_tag')
@@ -71,21 +270,24 @@ class EnhancedRAGEvaluator:
             "Latency": 0.0
         }
 
-        start_time = time.time()
+        if run is None:
+            return result_row
+
         try:
-            # 1. Run Pipeline
-            response = self.pipeline.run(question, k=top_k, include_sources=True)
-            elapsed = time.time() - start_time
+            response = run["response"]
 
-            # 2. Extract Basic Info
+            # 1. Extract Basic Info
             retrieved_sources = response.sources
             retrieved_filenames = [src.metadata.get('filename', '') for src in retrieved_sources]
             unique_papers = list(set(retrieved_filenames))
 
-            # 3. Calculate Metrics
+            # 2. Calculate Metrics
             chunk_metrics = self._calculate_chunk_metrics(
                 item.get('expected_chunk_id'),
-                retrieved_sources
+                retrieved_sources,
+                run["exact_rank"],
+                run["expected_text"],
+                embeddings
             )
 
             paper_metrics = self._calculate_paper_metrics(
@@ -95,10 +297,11 @@ class EnhancedRAGEvaluator:
 
             answer_metrics = self._calculate_answer_quality(
                 item.get('expected_answer'),
-                response.answer
+                response.answer,
+                embeddings
             )
 
-            # 4. Update Result Row
+            # 3. Update Result Row
             result_row.update({
                 "Exact_Chunk_Match": chunk_metrics["exact_match"],
                 "Chunk_Rank": chunk_metrics["rank"],
@@ -113,7 +316,7 @@ class EnhancedRAGEvaluator:
                 "Answer_Similarity": answer_metrics["similarity"],
 
                 "Papers": " | ".join([p.split(' - ')[0][:30] for p in unique_papers[:2]]),
-                "Latency": round(elapsed, 2)
+                "Latency": round(run["elapsed"], 2)
             })
 
         except Exception as e:
@@ -122,7 +325,30 @@ class EnhancedRAGEvaluator:
 
         return result_row
 
-    def _calculate_chunk_metrics(self, expected_chunk_id: Optional[str], sources: List[Any]) -> Dict[str, Any]:
+    @staticmethod
+    def _find_exact_match(expected_chunk_id: Optional[str], sources: List[Any]) -> Optional[int]:
+        """Returns the 1-based rank of the expected chunk among the sources, or None."""
+        if not expected_chunk_id:
+            return None
+
+        # ID before the fragment hash, computed once instead of per source
+        expected_prefix = expected_chunk_id.partition('#')[0]
+
+        for rank, src in enumerate(sources, 1):
+            parent_id = src.metadata.get('parent_id', '')
+            # Match strict ID or ID before fragment hash
+            if parent_id == expected_chunk_id or expected_prefix in parent_id:
+                return rank
+        return None
+
+    def _calculate_chunk_metrics(
+            self,
+            expected_chunk_id: Optional[str],
+            sources: List[Any],
+            exact_rank: Optional[int],
+            expected_text: Optional[str],
+            embeddings: Dict[str, np.ndarray]
+    ) -> Dict[str, Any]:
         """
         Determines if the correct chunk was retrieved (Exact Match) or if a semantically
         similar chunk was found (Semantic Hit).
@@ -137,41 +363,20 @@ class EnhancedRAGEvaluator:
         if not expected_chunk_id:
             return metrics
 
-        metrics["exact_match"] = False
-
-        # 1. Check Exact Match
-        for rank, src in enumerate(sources, 1):
-            parent_id = src.metadata.get('parent_id', '')
-            # Match strict ID or ID before fragment hash
-            if parent_id == expected_chunk_id or expected_chunk_id.split('#')[0] in parent_id:
-                metrics["exact_match"] = True
-                metrics["rank"] = rank
-                break
+        # 1. Exact Match (computed right after the pipeline run)
+        metrics["exact_match"] = exact_rank is not None
+        metrics["rank"] = exact_rank
 
         # 2. Check Semantic Similarity (if exact match failed)
-        if not metrics["exact_match"]:
-            try:
-                # Retrieve the actual text of the expected chunk from the DB
-                collection = self.pipeline.retriever.db_service.get_collection(
-                    self.pipeline.retriever.model_name
-                )
-                expected_docs = collection.get(ids=[expected_chunk_id])
-
-                if expected_docs and expected_docs['documents']:
-                    expected_text = expected_docs['documents'][0]
-                    expected_embedding = self.semantic_model.encode([expected_text])
-
-                    retrieved_texts = [src.page_content for src in sources]
-                    if retrieved_texts:
-                        retrieved_embeddings = self.semantic_model.encode(retrieved_texts)
-                        similarities = cosine_similarity(expected_embedding, retrieved_embeddings)[0]
-
-                        best_sim = float(similarities.max())
-                        metrics["similarity"] = round(best_sim, 3)
-                        metrics["semantic_hit"] = best_sim > 0.7
-            except Exception as e:
-                # If we can't fetch the expected chunk from DB, we skip semantic check
-                pass
+        texts = [src.page_content for src in sources]
+        has_embeddings = expected_text in embeddings and all(text in embeddings for text in texts)
+        if not metrics["exact_match"] and expected_text and sources and has_embeddings:
+            retrieved_embeddings = np.stack([embeddings[text] for text in texts])
+            similarities = retrieved_embeddings @ embeddings[expected_text]
+
+            best_sim = float(similarities.max())
+            metrics["similarity"] = round(best_sim, 3)
+            metrics["semantic_hit"] = best_sim > 0.7
 
         return metrics
 
@@ -200,20 +405,21 @@ class EnhancedRAGEvaluator:
 
         return metrics
 
-    def _calculate_answer_quality(self, expected_answer: Optional[str], generated_answer: str) -> Dict[str, float]:
+    def _calculate_answer_quality(
+            self,
+            expected_answer: Optional[str],
+            generated_answer: str,
+            embeddings: Dict[str, np.ndarray]
+    ) -> Dict[str, float]:
         """
         Calculates semantic similarity between the generated answer and the ground truth.
         """
         metrics = {"similarity": None}
 
-        if expected_answer and generated_answer:
-            try:
-                ans_embedding = self.semantic_model.encode([generated_answer])
-                exp_embedding = self.semantic_model.encode([expected_answer])
-                sim = float(cosine_similarity(ans_embedding, exp_embedding)[0][0])
-                metrics["similarity"] = round(sim, 3)
-            except Exception:
-                pass
+        if generated_answer in embeddings and expected_answer in embeddings:
+            # Both vectors are normalized, so the dot product is the cosine similarity
+            sim = float(embeddings[generated_answer] @ embeddings[expected_answer])
+            metrics["similarity"] = round(sim, 3)
 
         return metrics
 
@@ -1,21 +1,119 @@
 import asyncio
-from typing import List, Dict, Any, Optional
+import importlib.util
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
 
 import httpx
 from fastapi import HTTPException
 
 
+class _RateLimiter:
+    """
+    Spaces request starts at least 1 / requests_per_second apart. Unlike a sleep
+    after each call, requests can overlap: only their start times are paced.
+    Safe to share across event loops and threads (no loop-bound primitives).
+    """
+
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self._next_start = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._next_start - now)
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
 class SemanticScholarService:
     RECOMMENDATION_URL = "https://api.semanticscholar.org/recommendations/v1/papers/"
     SEARCH_URL = "https://api.semanticscholar.org/graph/v1/paper/search"
     SNIPPET_SEARCH_URL = "https://api.semanticscholar.org/graph/v1/snippet/search"
     BATCH_DETAILS_URL = "https://api.semanticscholar.org/graph/v1/paper/batch"
+    # The batch endpoint rejects requests with more IDs than this
+    BATCH_DETAILS_MAX_IDS = 500
 
-    def __init__(self, api_key: str = None):
+    def __init__(
+            self,
+            api_key: str = None,
+            requests_per_second: Optional[float] = None,
+            max_concurrency: int = 5,
+            cache_ttl: float = 3600.0,
+            cache_max_entries: int = 1024
+    ):
+        """
+        Args:
+            requests_per_second: Budget shared by all calls of this service instance.
+                Defaults to 10 with an API key and 1 without (Semantic Scholar's limits).
+            max_concurrency: Upper bound on title lookups in flight at once.
+            cache_ttl: Seconds a successful ID search / batch lookup is served from memory (0 disables).
+            cache_max_entries: Oldest cached responses are dropped beyond this size.
+        """
         self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        if requests_per_second is None:
+            requests_per_second = 10.0 if api_key else 1.0
+        self._rate_limiter = _RateLimiter(requests_per_second)
+        self.cache_ttl = cache_ttl
+        self.cache_max_entries = cache_max_entries
+        self._response_cache: Dict[Tuple, Tuple[float, Any]] = {}
         if not self.api_key:
             print("Warning: No Semantic Scholar API Key provided. Rate limits will be strict.")
 
+        # One pooled client per event loop (see _get_client)
+        self._clients: Dict[asyncio.AbstractEventLoop, httpx.AsyncClient] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        Returns a long-lived AsyncClient so keep-alive connections (and their TLS
+        sessions) are reused across calls. Clients are bound to the event loop they
+        were created on, so each loop gets its own; callers that start a short-lived
+        loop (perform_online_search_sync) must await aclose() before it ends.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            headers = {"x-api-key": self.api_key} if self.api_key else {}
+            # HTTP/2 multiplexes the concurrent title lookups over one connection. It needs
+            # the optional h2 package; httpx also advertises brotli on its own once the
+            # brotli package is installed.
+            client = httpx.AsyncClient(
+                headers=headers,
+                timeout=10.0,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                http2=importlib.util.find_spec("h2") is not None
+            )
+            self._clients[loop] = client
+        return client
+
+    def _cache_get(self, key: Tuple) -> Optional[Any]:
+        entry = self._response_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._response_cache.pop(key, None)
+            return None
+        return value
+
+    def _cache_put(self, key: Tuple, value: Any):
+        if self.cache_ttl <= 0:
+            return
+        self._response_cache[key] = (time.monotonic() + self.cache_ttl, value)
+        # Dicts keep insertion order, so the first key is the oldest entry
+        while len(self._response_cache) > self.cache_max_entries:
+            self._response_cache.pop(next(iter(self._response_cache)), None)
+
+    async def aclose(self):
+        """Closes the pooled client of the running loop; call before that loop ends."""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
     async def get_recommendations(
             self,
             positive_ids: List[str],
@@ -23,10 +121,6 @@ class SemanticScholarService:
             limit: int = 10
     ) -> List[Dict[str, Any]]:
 
-        headers = {}
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
-
         payload = {
             "positivePaperIds": positive_ids,
             "negativePaperIds": negative_ids or [],
@@ -37,31 +131,30 @@ class SemanticScholarService:
             "limit": limit
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    self.RECOMMENDATION_URL,
-                    json=payload,
-                    headers=headers,
-                    params=params,
-                    timeout=10.0
-                )
+        await self._rate_limiter.acquire()
+        client = self._get_client()
+        try:
+            response = await client.post(
+                self.RECOMMENDATION_URL,
+                json=payload,
+                params=params
+            )
 
-                if response.status_code == 403:
-                    raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
+            if response.status_code == 403:
+                raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
 
-                response.raise_for_status()
-                data = response.json()
+            response.raise_for_status()
+            data = response.json()
 
-                return data.get("recommendedPapers", [])
+            return data.get("recommendedPapers", [])
 
-            except httpx.HTTPStatusError as e:
-                error_msg = f"Semantic Scholar Error {e.response.status_code}: {e.response.text}"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=e.response.status_code, detail=error_msg)
-            except Exception as e:
-                print(f"Error: Recommendation Service Failed: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Semantic Scholar Error {e.response.status_code}: {e.response.text}"
+            print(f"Error: {error_msg}")
+            raise HTTPException(status_code=e.response.status_code, detail=error_msg)
+        except Exception as e:
+            print(f"Error: Recommendation Service Failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
     async def get_recommendations_from_docs(
             self,
@@ -87,16 +180,9 @@ class SemanticScholarService:
 
         print(f"Extracted {len(unique_titles)} unique titles from docs.")
 
-        # 2. Resolve Titles to Paper IDs
-        positive_ids = []
-        for i, title in enumerate(unique_titles):
-            # Rate limit protection for resolving IDs
-            if i > 0:
-                await asyncio.sleep(0.8)
-
-            paper_id = await self.search_paper_id(title)
-            if paper_id:
-                positive_ids.append(paper_id)
+        # 2. Resolve Titles to Paper IDs (concurrently, rate-limited)
+        resolved = await self._resolve_titles(list(unique_titles))
+        positive_ids = [ids[0] for ids in resolved if ids]
 
         if not positive_ids:
             print("No valid paper IDs found to generate recommendations.")
@@ -104,7 +190,6 @@ class SemanticScholarService:
 
         # 3. Get Recommendations
         print(f"Requesting recommendations based on {len(positive_ids)} papers...")
-        await asyncio.sleep(0.8)
         return await self.get_recommendations(
             positive_ids=positive_ids,
             negative_ids=negative_ids,
@@ -114,11 +199,12 @@ class SemanticScholarService:
     async def search_paper_ids(self, query: str, limit: int = 1) -> List[str]:
         """
         Searches for papers by query and returns a list of paperIds.
-        Used as the first step before batch retrieval.
+        Used as the first step before batch retrieval. Successful responses are cached.
         """
-        headers = {}
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
+        cache_key = ("search_ids", query, limit)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return list(cached)
 
         params = {
             "query": query,
@@ -126,33 +212,51 @@ class SemanticScholarService:
             "fields": "paperId"  # Only fetch ID to keep it lightweight
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    self.SEARCH_URL,
-                    headers=headers,
-                    params=params,
-                    timeout=10.0
-                )
-
-                if response.status_code == 403:
-                    print("Error: Semantic Scholar API Key invalid or missing during search.")
-                    return []
+        await self._rate_limiter.acquire()
+        client = self._get_client()
+        try:
+            response = await client.get(
+                self.SEARCH_URL,
+                params=params
+            )
 
-                response.raise_for_status()
-                data = response.json()
-                results = data.get("data", [])
+            if response.status_code == 403:
+                print("Error: Semantic Scholar API Key invalid or missing during search.")
+                return []
 
-                ids = [item.get("paperId") for item in results if item.get("paperId")]
+            response.raise_for_status()
+            data = response.json()
+            results = data.get("data", [])
 
-                if not ids:
-                    print(f"No papers found for query: '{query}'")
+            ids = [item.get("paperId") for item in results if item.get("paperId")]
 
-                return ids
+            if not ids:
+                print(f"No papers found for query: '{query}'")
 
-            except Exception as e:
-                print(f"Error: Paper Search Failed: {e}")
-                return []
+            self._cache_put(cache_key, ids)
+            return list(ids)
+
+        except Exception as e:
+            print(f"Error: Paper Search Failed: {e}")
+            return []
+
+    async def _resolve_titles(self, titles: List[str]) -> List[List[str]]:
+        """
+        Resolves titles to paper IDs concurrently, in input order. At most
+        max_concurrency lookups are in flight; the rate limiter paces their starts.
+        """
+        # Created per call: asyncio primitives bind to the loop they are first used on
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def resolve(title: str) -> List[str]:
+            async with semaphore:
+                try:
+                    return await self.search_paper_ids(title, limit=1)
+                except Exception as e:
+                    print(f"Error resolving ID for title '{title}': {e}")
+                    return []
+
+        return await asyncio.gather(*(resolve(title) for title in titles))
 
     async def search_paper_id(self, query: str, limit: int = 1) -> Optional[str]:
         """
@@ -162,10 +266,6 @@ class SemanticScholarService:
         return ids[0] if ids else None
 
     async def search_text_snippets(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
-        headers = {}
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
-
         if limit > 1000:
             limit = 1000
 
@@ -174,65 +274,59 @@ class SemanticScholarService:
             "limit": limit
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    self.SNIPPET_SEARCH_URL,
-                    headers=headers,
-                    params=params,
-                    timeout=10.0
-                )
-
-                if response.status_code == 403:
-                    raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
-
-                response.raise_for_status()
-                data = response.json()
-                return data.get("data", [])
-
-            except httpx.HTTPStatusError as e:
-                error_msg = f"Semantic Scholar Snippet Error {e.response.status_code}: {e.response.text}"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=e.response.status_code, detail=error_msg)
-            except Exception as e:
-                print(f"Error: Snippet Search Failed: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
+        await self._rate_limiter.acquire()
+        client = self._get_client()
+        try:
+            response = await client.get(
+                self.SNIPPET_SEARCH_URL,
+                params=params
+            )
 
-    async def search_papers(self, query: str, limit: int = 1) -> List[Dict[str, Any]]:
-        headers = {}
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
+            if response.status_code == 403:
+                raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
+
+            response.raise_for_status()
+            data = response.json()
+            return data.get("data", [])
 
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Semantic Scholar Snippet Error {e.response.status_code}: {e.response.text}"
+            print(f"Error: {error_msg}")
+            raise HTTPException(status_code=e.response.status_code, detail=error_msg)
+        except Exception as e:
+            print(f"Error: Snippet Search Failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def search_papers(self, query: str, limit: int = 1) -> List[Dict[str, Any]]:
         params = {
             "query": query,
             "limit": limit,
             "fields": "paperId,title,year,url,authors,abstract"
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.get(
-                    self.SEARCH_URL,
-                    headers=headers,
-                    params=params,
-                    timeout=10.0
-                )
+        await self._rate_limiter.acquire()
+        client = self._get_client()
+        try:
+            response = await client.get(
+                self.SEARCH_URL,
+                params=params
+            )
 
-                if response.status_code == 403:
-                    raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
+            if response.status_code == 403:
+                raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
 
-                response.raise_for_status()
-                data = response.json()
+            response.raise_for_status()
+            data = response.json()
 
-                return data.get("data", [])
+            return data.get("data", [])
 
-            except httpx.HTTPStatusError as e:
-                error_msg = f"Semantic Scholar Error {e.response.status_code}: {e.response.text}"
-                print(f"Semantic Scholar Search Error: {error_msg}")
-                raise HTTPException(status_code=e.response.status_code, detail=error_msg)
-            except Exception as e:
-                print(f"Paper Search Failed: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Semantic Scholar Error {e.response.status_code}: {e.response.text}"
+            print(f"Semantic Scholar Search Error: {error_msg}")
+            raise HTTPException(status_code=e.response.status_code, detail=error_msg)
+        except Exception as e:
+            print(f"Paper Search Failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
     async def get_papers_details_batch(
             self,
@@ -241,14 +335,28 @@ class SemanticScholarService:
     ) -> List[Dict[str, Any]]:
         """
         Get details for multiple papers at once using the batch endpoint.
+        Lists above the endpoint's ID limit are split and the parts fetched concurrently.
         """
         if not paper_ids:
             return []
 
-        headers = {}
-        if self.api_key:
-            headers["x-api-key"] = self.api_key
+        cache_key = ("details", tuple(paper_ids), fields)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return list(cached)
+
+        step = self.BATCH_DETAILS_MAX_IDS
+        parts = await asyncio.gather(*(
+            self._post_details_batch(paper_ids[i:i + step], fields)
+            for i in range(0, len(paper_ids), step)
+        ))
+        papers = [paper for part in parts for paper in part]
+
+        self._cache_put(cache_key, papers)
+        return list(papers)
 
+    async def _post_details_batch(self, paper_ids: List[str], fields: str) -> List[Dict[str, Any]]:
+        """Single batch-endpoint request for at most BATCH_DETAILS_MAX_IDS IDs."""
         params = {
             "fields": fields
         }
@@ -257,40 +365,39 @@ class SemanticScholarService:
             "ids": paper_ids
         }
 
-        async with httpx.AsyncClient() as client:
-            try:
-                response = await client.post(
-                    self.BATCH_DETAILS_URL,
-                    params=params,
-                    json=payload,
-                    headers=headers,
-                    timeout=10.0
-                )
-
-                if response.status_code == 403:
-                    raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
-
-                response.raise_for_status()
-                data = response.json()
-
-                # Filter out None results
-                valid_papers = [p for p in data if p is not None]
-                return valid_papers
-
-            except httpx.HTTPStatusError as e:
-                error_msg = f"Semantic Scholar Batch Error {e.response.status_code}: {e.response.text}"
-                print(f"Error: {error_msg}")
-                raise HTTPException(status_code=e.response.status_code, detail=error_msg)
-            except Exception as e:
-                print(f"Error: Batch Details Failed: {e}")
-                raise HTTPException(status_code=500, detail=str(e))
+        await self._rate_limiter.acquire()
+        client = self._get_client()
+        try:
+            response = await client.post(
+                self.BATCH_DETAILS_URL,
+                params=params,
+                json=payload
+            )
+
+            if response.status_code == 403:
+                raise HTTPException(status_code=403, detail="Semantic Scholar API Key invalid or missing.")
+
+            response.raise_for_status()
+            data = response.json()
+
+            # Filter out None results
+            valid_papers = [p for p in data if p is not None]
+            return valid_papers
+
+        except httpx.HTTPStatusError as e:
+            error_msg = f"Semantic Scholar Batch Error {e.response.status_code}: {e.response.text}"
+            print(f"Error: {error_msg}")
+            raise HTTPException(status_code=e.response.status_code, detail=error_msg)
+        except Exception as e:
+            print(f"Error: Batch Details Failed: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
     async def smart_search(self, query: str, limit: int = 1) -> List[Dict[str, Any]]:
         """
         1. Searches using standard paper search.
         2. If no results, searches text snippets.
-        3. Extracts TITLES from snippets.
-        4. Searches those titles sequentially with DELAYS to get valid Paper IDs.
+        3. Takes paper IDs straight from the snippets' paper objects.
+        4. Resolves titles to Paper IDs only for snippets without an ID.
         5. Uses those IDs to fetch full details via batch.
         """
         # 1. Try standard paper search
@@ -311,41 +418,30 @@ class SemanticScholarService:
                 print("No snippets found.")
                 return []
 
-            # 3. Extract Titles from snippets
+            # 3. Snippet papers carry a corpusId, which the batch endpoint accepts
+            #    as "CorpusId:<id>"; only fall back to titles when it is missing
+            found_ids = set()
             titles_to_search = set()
             for snippet in snippets:
-                if "paper" in snippet and "title" in snippet["paper"]:
-                    titles_to_search.add(snippet["paper"]["title"])
+                paper = snippet.get("paper") or {}
+                if paper.get("paperId"):
+                    found_ids.add(paper["paperId"])
+                elif paper.get("corpusId"):
+                    found_ids.add(f"CorpusId:{paper['corpusId']}")
+                elif "title" in paper:
+                    titles_to_search.add(paper["title"])
                 elif "title" in snippet:
                     titles_to_search.add(snippet["title"])
 
-            if not titles_to_search:
-                print("Snippets found, but no titles could be extracted.\n")
-                return []
-
-            # 4. Search for IDs using the extracted Titles (Sequential with Sleep)
-            found_ids = set()
-            for i, title in enumerate(titles_to_search):
-                try:
-                    # RATE LIMIT PROTECTION:
-                    # Sleep for 1 second between requests to avoid "Too Many Requests"
-                    if i > 0:
-                        await asyncio.sleep(1.0)
-
-                    ids = await self.search_paper_ids(title, limit=1)
-                    if ids:
-                        found_ids.update(ids)
-                except Exception as e:
-                    print(f"Error resolving ID for title '{title}': {e}")
-                    continue
+            # 4. Search for IDs using the remaining Titles (concurrent, rate-limited)
+            if titles_to_search:
+                resolved = await self._resolve_titles(list(titles_to_search))
+                found_ids.update(paper_id for ids in resolved for paper_id in ids)
 
             if not found_ids:
-                print("No valid paper IDs found from snippet titles.\n")
+                print("No valid paper IDs found in the snippets.\n")
                 return []
 
-            # Short delay before the final batch call
-            await asyncio.sleep(0.5)
-
             # 5. Get full details for the confirmed IDs
             papers_data = await self.get_papers_details_batch(
                 paper_ids=list(found_ids),
@@ -1,43 +1,447 @@
-from typing import List, Dict
+import asyncio
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import List, Dict, Union, Optional
 
 import chromadb
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+# HNSW build/search parameters for new collections. Construction params are fixed once
+# a collection exists; search_ef can be changed later with set_search_ef().
+DEFAULT_HNSW_CONFIG = {
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    "hnsw:search_ef": 100
+}
+
+
+def _l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Row-wise unit length (new array), so inner product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class FaissBackend:
+    """
+    In-memory FAISS HNSW index mirroring one Chroma collection.
+
+    Chroma stays the source of truth for documents and metadata; this only
+    answers the nearest-neighbour lookup. HNSW graphs cannot delete vectors,
+    so re-upserted or deleted ids leave a stale entry behind that is skipped
+    at query time (the search over-fetches by the number of stale entries).
+    Once more than MAX_STALE_FRACTION of the entries are stale, needs_rebuild is
+    set and VectorDBService drops the mirror, which is rebuilt from live rows.
+    """
+
+    MAX_STALE_FRACTION = 0.2
+
+    def __init__(
+            self,
+            dim: int,
+            m: int = 32,
+            ef_construction: int = 40,
+            ef_search: int = 16,
+            quantization: Optional[str] = None
+    ):
+        """
+        Args:
+            quantization: None stores fp32 vectors; "fp16" halves the memory read per
+                distance; "int8" stores 8-bit scalar-quantized codes (4x less) over the
+                fixed [-1, 1] range of unit vectors.
+        """
+        if quantization not in (None, "fp16", "int8"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+
+        # Inner product matches the collection's "ip" space (vectors are normalized on upsert)
+        if quantization == "int8":
+            hnsw = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, m, faiss.METRIC_INNER_PRODUCT)
+        elif quantization == "fp16":
+            hnsw = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            hnsw = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = ef_construction
+        hnsw.hnsw.efSearch = ef_search
+        if quantization is not None:
+            # Upserted vectors are L2-normalized, so every component lies in [-1, 1].
+            # Training on exactly those bounds fixes the quantizer range up front instead
+            # of clipping all later documents to the first batch's per-dimension min/max.
+            bounds = np.vstack([np.full(dim, -1.0), np.full(dim, 1.0)]).astype(np.float32)
+            hnsw.train(bounds)
+        self._hnsw = hnsw
+        self.index = faiss.IndexIDMap(hnsw)
+
+        self._int_ids: Dict[str, int] = {}  # live string id -> current FAISS id
+        self._str_ids: Dict[int, str] = {}  # FAISS id -> string id (live entries only)
+        self._next_id = 0
+        self._stale = 0
+
+    def set_ef_search(self, ef_search: int):
+        self._hnsw.hnsw.efSearch = ef_search
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return self._stale > self.MAX_STALE_FRACTION * self.index.ntotal
+
+    def add(self, ids: List[str], embeddings: np.ndarray):
+        int_ids = np.arange(self._next_id, self._next_id + len(ids), dtype=np.int64)
+        self._next_id += len(ids)
+
+        for doc_id, int_id in zip(ids, int_ids.tolist()):
+            old = self._int_ids.get(doc_id)
+            if old is not None:
+                del self._str_ids[old]
+                self._stale += 1
+            self._int_ids[doc_id] = int_id
+            self._str_ids[int_id] = doc_id
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.index.add_with_ids(embeddings, int_ids)
+
+    def remove(self, ids: List[str]):
+        for doc_id in ids:
+            int_id = self._int_ids.pop(doc_id, None)
+            if int_id is not None:
+                del self._str_ids[int_id]
+                self._stale += 1
+
+    def search(self, query_embeddings: np.ndarray, n_results: int):
+        """
+        Returns (ids, scores) with one entry per query row: the n_results best live
+        entries and their scores as a float32 array.
+        """
+        n_queries = len(query_embeddings)
+        k = min(n_results + self._stale, self.index.ntotal)
+        if k == 0:
+            return [[] for _ in range(n_queries)], [np.empty(0, dtype=np.float32) for _ in range(n_queries)]
+
+        scores, int_ids = self.index.search(query_embeddings, k)
+
+        all_hits, all_scores = [], []
+        for row_scores, row_ids in zip(scores, int_ids.tolist()):
+            hits, positions = [], []
+            for pos, int_id in enumerate(row_ids):
+                doc_id = self._str_ids.get(int_id)
+                if doc_id is None:
+                    continue
+                hits.append(doc_id)
+                positions.append(pos)
+                if len(hits) == n_results:
+                    break
+            all_hits.append(hits)
+            all_scores.append(row_scores[positions])
+        return all_hits, all_scores
+
+
+class QueryCoalescer:
+    """
+    Coalesces concurrent single-vector query() calls into one query_batch() call
+    per (model_key, n_results), like QueryBatcher does for query encoding.
+
+    A background thread waits up to max_wait_ms after the first request (or until
+    max_batch requests are queued) and splits the batched result back per caller.
+    """
+
+    # Per-query columns of a Chroma query result (one list entry per query row)
+    _ROW_KEYS = ("ids", "documents", "metadatas", "distances", "embeddings")
+
+    def __init__(self, db_service: "VectorDBService", max_batch: int = 32, max_wait_ms: float = 2.0):
+        self._db_service = db_service
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="QueryCoalescer", daemon=True)
+        self._worker.start()
+
+    def enqueue(self, model_key: str, query_embedding: np.ndarray, n_results: int) -> Future:
+        """Queues one query vector and returns a Future for its single-row result."""
+        future = Future()
+        self._queue.put((model_key, n_results, query_embedding, future))
+        return future
+
+    def _run(self):
+        while True:
+            # 1. Block for the first request, then collect until the window closes
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            # 2. One batched query per (collection, k), then scatter rows back
+            groups = defaultdict(list)
+            for model_key, n_results, query_embedding, future in pending:
+                groups[(model_key, n_results)].append((query_embedding, future))
+
+            for (model_key, n_results), items in groups.items():
+                try:
+                    results = self._db_service.query_batch(
+                        model_key, np.stack([vector for vector, _ in items]), n_results
+                    )
+                except Exception as e:
+                    for _, future in items:
+                        future.set_exception(e)
+                    continue
+
+                for row, (_, future) in enumerate(items):
+                    future.set_result(self._row(results, row))
+
+    @classmethod
+    def _row(cls, results: Dict, row: int) -> Dict:
+        """Single-query view of a batched result, in the shape query() returns."""
+        return {
+            key: [value[row]] if key in cls._ROW_KEYS and value is not None else value
+            for key, value in results.items()
+        }
 
 
 class VectorDBService:
-    def __init__(self, db_path: str, collection_names: Dict[str, str]):
+    def __init__(
+            self,
+            db_path: str,
+            collection_names: Dict[str, str],
+            use_faiss: bool = False,
+            faiss_quantization: Optional[str] = None,
+            upsert_batch_size: int = 200,
+            upsert_retries: int = 3,
+            collection_config: Optional[Dict[str, Dict]] = None,
+            coalesce_queries: bool = False
+    ):
+        """
+        Args:
+            use_faiss: If True, nearest-neighbour queries are answered by an in-memory
+                FAISS HNSW index per model key (built from the collection on first use).
+            faiss_quantization: Passed to FaissBackend; "fp16" or "int8" shrink the in-memory vectors.
+            upsert_batch_size: Rows per collection.upsert call. Chroma's write throughput
+                drops for very large single calls (and they can exceed its max batch size).
+            upsert_retries: Attempts per batch, with exponential backoff, before giving up.
+            collection_config: Per model key overrides of DEFAULT_HNSW_CONFIG, e.g.
+                {"qwen": {"hnsw:M": 32}}. Only applied when a collection is created.
+            coalesce_queries: If True, concurrent query() calls are merged into one
+                query_batch() by a QueryCoalescer (adds up to 2 ms of wait per query).
+        """
+        if use_faiss and faiss is None:
+            raise ImportError("use_faiss=True requires the faiss package (faiss-cpu or faiss-gpu)")
+
         self.client = chromadb.PersistentClient(path=db_path)
         self.collection_names = collection_names
+        self.use_faiss = use_faiss
+        self.faiss_quantization = faiss_quantization
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_retries = upsert_retries
+        self.collection_config = collection_config or {}
         # Cache collections to avoid fetching them repeatedly
         self._collections = {}
+        self._faiss = {}
+        # Per-collection write counters, see version()
+        self._versions: Dict[str, int] = {}
+        # Read caches validated against version(): key -> (version, value)
+        self._stats_cache: Dict[str, tuple] = {}
+        self._ids_cache: Dict[tuple, tuple] = {}
+        self._coalescer = QueryCoalescer(self) if coalesce_queries else None
+
+    def version(self, model_key: str) -> int:
+        """
+        Returns a counter that changes on every write to the collection through this
+        service (upsert, delete, clear). Query results are deterministic between
+        writes, so (model_key, version, query, n_results) is a valid cache key/ETag.
+        """
+        return self._versions.get(model_key, 0)
+
+    def _bump_version(self, model_key: str):
+        self._versions[model_key] = self._versions.get(model_key, 0) + 1
 
     def get_collection(self, model_key: str) -> chromadb.Collection:
         if model_key not in self._collections:
             name = self.collection_names.get(model_key, "default_collection")
+            # Canonical scoring path: vectors are L2-normalized on insert and query, so
+            # "ip" is cosine and the reported distance is 1 - cosine (lower is closer)
             self._collections[model_key] = self.client.get_or_create_collection(
                 name=name,
-                metadata={"hnsw:space": "ip"}
+                metadata={**self._hnsw_config(model_key), "hnsw:space": "ip"}
             )
         return self._collections[model_key]
 
+    def _hnsw_config(self, model_key: str) -> Dict:
+        return {**DEFAULT_HNSW_CONFIG, **self.collection_config.get(model_key, {})}
+
+    def set_search_ef(self, model_key: str, ef: int):
+        """
+        Changes the query-time candidate list size (recall vs latency) of an existing
+        collection, and of its FAISS index when one is built.
+        """
+        collection = self.get_collection(model_key)
+        try:
+            collection.modify(configuration={"hnsw": {"ef_search": ef}})
+        except TypeError:
+            # chromadb < 1.0 has no configuration argument; HNSW params live in the metadata
+            collection.modify(metadata={**(collection.metadata or {}), "hnsw:search_ef": ef})
+
+        self.collection_config.setdefault(model_key, {})["hnsw:search_ef"] = ef
+        backend = self._faiss.get(model_key)
+        if backend is not None:
+            backend.set_ef_search(ef)
+
     def upsert_chunks(
         self,
         model_key: str,
         ids: List[str],
         documents: List[str],
-        embeddings: List[List[float]],
-        metadata: List[Dict]
+        embeddings: Union[np.ndarray, List[List[float]]],
+        metadata: List[Dict],
+        batch_size: Optional[int] = None
     ):
+        """
+        Writes the chunks in batches of batch_size rows (default: upsert_batch_size).
+        If a batch still fails after retrying, the batches before it stay written.
+        """
+        # Chroma accepts ndarrays directly; no per-scalar Python float conversion needed.
+        # Normalizing once here makes the collection's "ip" space score as cosine.
+        embeddings = _l2_normalize(np.asarray(embeddings, dtype=np.float32))
         collection = self.get_collection(model_key)
-        collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadata)
+        step = batch_size or self.upsert_batch_size
+
+        try:
+            for i in range(0, len(ids), step):
+                self._upsert_batch(
+                    collection,
+                    ids=ids[i:i + step],
+                    embeddings=embeddings[i:i + step],
+                    documents=documents[i:i + step],
+                    metadatas=metadata[i:i + step]
+                )
+        except Exception:
+            # The FAISS mirror no longer matches; rebuild it from the collection on next use
+            self._faiss.pop(model_key, None)
+            raise
+        finally:
+            # Earlier batches are committed even if a later one fails
+            self._bump_version(model_key)
+
+        if self.use_faiss:
+            backend = self._faiss.get(model_key)
+            if backend is None:
+                # First touch builds the index from the collection, which now includes these rows
+                self._get_faiss(model_key)
+            else:
+                backend.add(ids, embeddings)
+                if backend.needs_rebuild:
+                    # Re-ingests piled up dead HNSW entries; rebuild from the collection on next use
+                    self._faiss.pop(model_key, None)
+
+    def _upsert_batch(self, collection: chromadb.Collection, **batch):
+        """Upserts one batch, retrying transient failures (e.g. a locked SQLite file)."""
+        for attempt in range(self.upsert_retries):
+            try:
+                collection.upsert(**batch)
+                return
+            except Exception as e:
+                if attempt == self.upsert_retries - 1:
+                    raise
+                delay = 0.5 * 2 ** attempt
+                print(f"Upsert of {len(batch['ids'])} chunks failed ({e}), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+
+    def _get_faiss(self, model_key: str) -> FaissBackend:
+        """Returns the FAISS index for a model key, building it from the collection on first use."""
+        if model_key not in self._faiss:
+            collection = self.get_collection(model_key)
+            data = collection.get(include=["embeddings"])
+            embeddings = np.asarray(data["embeddings"], dtype=np.float32)
 
-    def query(self, model_key: str, query_embedding: List[float], n_results: int):
+            if not len(data["ids"]):
+                # Nothing to index yet; the dimension is only known once vectors arrive
+                return None
+
+            hnsw_config = self._hnsw_config(model_key)
+            backend = FaissBackend(
+                dim=embeddings.shape[1],
+                m=hnsw_config["hnsw:M"],
+                ef_construction=hnsw_config["hnsw:construction_ef"],
+                ef_search=hnsw_config["hnsw:search_ef"],
+                quantization=self.faiss_quantization
+            )
+            backend.add(data["ids"], embeddings)
+            self._faiss[model_key] = backend
+
+        return self._faiss[model_key]
+
+    def query(self, model_key: str, query_embedding: Union[np.ndarray, List[float]], n_results: int):
+        query_embeddings = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        if self._coalescer is not None:
+            return self._coalescer.enqueue(model_key, query_embeddings[0], n_results).result()
+        return self.query_batch(model_key, query_embeddings, n_results)
+
+    async def aquery(self, model_key: str, query_embedding: Union[np.ndarray, List[float]], n_results: int):
+        """Async variant of query(); awaits the coalescer (or a worker thread) instead of blocking the loop."""
+        if self._coalescer is None:
+            return await asyncio.to_thread(self.query, model_key, query_embedding, n_results)
+
+        query_embeddings = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+        return await asyncio.wrap_future(self._coalescer.enqueue(model_key, query_embeddings[0], n_results))
+
+    def query_batch(
+            self,
+            model_key: str,
+            query_embeddings: Union[np.ndarray, List[List[float]]],
+            n_results: int
+    ):
+        """
+        Runs several queries in one call (one index traversal setup and one document
+        fetch for all of them). Every result list has one entry per query row.
+        """
+        query_embeddings = _l2_normalize(np.asarray(query_embeddings, dtype=np.float32))
         collection = self.get_collection(model_key)
-        return collection.query(query_embeddings=[query_embedding], n_results=n_results)
+
+        if not self.use_faiss:
+            return collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+        # 1. Graph search in FAISS
+        backend = self._get_faiss(model_key)
+        if backend is not None:
+            ids, scores = backend.search(query_embeddings, n_results)
+        else:
+            ids = [[] for _ in range(len(query_embeddings))]
+            scores = [np.empty(0, dtype=np.float32) for _ in range(len(query_embeddings))]
+
+        # 2. Fetch documents/metadata of all hits from Chroma at once (get() does not preserve order)
+        unique_ids = list(dict.fromkeys(doc_id for row in ids for doc_id in row))
+        rows = collection.get(ids=unique_ids, include=["documents", "metadatas"]) if unique_ids else {"ids": []}
+        position = {doc_id: i for i, doc_id in enumerate(rows["ids"])}
+
+        # 3. Same shape as collection.query(); Chroma reports "ip" distance as 1 - dot.
+        #    Distances stay float32 arrays instead of lists of boxed Python floats.
+        return {
+            "ids": ids,
+            "documents": [[rows["documents"][position[doc_id]] for doc_id in row] for row in ids],
+            "metadatas": [[rows["metadatas"][position[doc_id]] for doc_id in row] for row in ids],
+            "distances": [1.0 - row_scores for row_scores in scores]
+        }
 
     def delete_chunks(self, model_key: str, ids: List[str]):
         """Deletes specific chunks by ID."""
         collection = self.get_collection(model_key)
         collection.delete(ids=ids)
+        self._bump_version(model_key)
+
+        backend = self._faiss.get(model_key)
+        if backend is not None:
+            backend.remove(ids)
+            if backend.needs_rebuild:
+                self._faiss.pop(model_key, None)
 
     def clear_collection(self, model_key: str):
         """
@@ -59,20 +463,30 @@ class VectorDBService:
         # If we don't do this, self.get_collection() will return a dead object
         if model_key in self._collections:
             del self._collections[model_key]
+        self._faiss.pop(model_key, None)
+        self._bump_version(model_key)
 
         print(f"Collection '{name}' deleted and cache cleared.")
 
     def get_stats(self, model_key: str) -> int:
-        """Returns the count of documents for a specific collection."""
+        """Returns the count of documents for a specific collection (cached until the next write)."""
         name = self.collection_names.get(model_key)
         if not name:
             raise ValueError(f"Unknown model key: {model_key}")
 
+        version = self.version(model_key)
+        cached = self._stats_cache.get(model_key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
         try:
             coll = self.client.get_collection(name)
-            return coll.count()
+            count = coll.count()
         except ValueError:
-            return 0
+            count = 0
+
+        self._stats_cache[model_key] = (version, count)
+        return count
 
     def get_chunk(self, model_key: str, doc_id: str):
         """Fetches a single chunk's data by ID."""
@@ -89,7 +503,14 @@ class VectorDBService:
         }
 
     def list_ids(self, model_key: str, limit: int = 100, offset: int = 0):
-        """Lists IDs from a collection with pagination."""
+        """Lists IDs from a collection with pagination (cached until the next write)."""
+        key = (model_key, limit, offset)
+        version = self.version(model_key)
+        cached = self._ids_cache.get(key)
+        if cached is not None and cached[0] == version:
+            return list(cached[1])
+
         collection = self.get_collection(model_key)
         result = collection.get(limit=limit, offset=offset, include=[])
-        return result["ids"]
+        self._ids_cache[key] = (version, result["ids"])
+        return list(result["ids"])
@@ -1,7 +1,16 @@
 import asyncio
+import io
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Callable, Any, List, Dict, Optional
+from typing import Callable, Any, List, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from backend.services.rag_answer_service import ChromaRagRetriever
 from backend.services.recommendation import SemanticScholarService
@@ -10,19 +19,26 @@ from llmAG.rag import RagPipeline
 from pdfProcessing.docling_PDF_processor import DoclingPDFProcessor
 from zotero_integration.zotero_client import ZoteroClient
 
+# Section and sub-section rules used throughout the console/file output below
+_SEP = "=" * 80
+_RULE = "-" * 80
 
-def perform_online_search_sync(
+# Runs speculative online searches next to the local RAG pipeline (see query_rag)
+_online_search_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="online-search")
+
+
+async def perform_online_search(
         service: SemanticScholarService,
         query: str,
         top_k: int
 ) -> str:
     """
-    Wrapper to run smart_search synchronously.
+    Runs smart_search on the caller's event loop (reusing the service's pooled client).
     It loops through ALL retrieved papers and formats them into a single string,
     including the Title, Year, URL, and Abstract.
     """
     try:
-        papers = asyncio.run(service.smart_search(query, limit=top_k))
+        papers = await service.smart_search(query, limit=top_k)
 
         if not papers:
             return "Looking for additional scientific information online, but no results were found.\n"
@@ -39,16 +55,17 @@ def perform_online_search_sync(
             if len(abstract) > 500:
                 abstract = abstract[:500] + "..."
 
-            # Format the entry with the URL included
-            entry = (
-                f"{'=' * 80}\n"
-                f"[Online Source {i}]\n"
-                f"{'=' * 80}\n"
-                f"{title} ({year})\n"
-                f"Link: {url}\n"
-                f"Abstract: {abstract}\n"
-                f"{'=' * 80}\n"
-            )
+            # Format the entry with the URL included (trailing "" keeps the final newline)
+            entry = "\n".join((
+                _SEP,
+                f"[Online Source {i}]",
+                _SEP,
+                f"{title} ({year})",
+                f"Link: {url}",
+                f"Abstract: {abstract}",
+                _SEP,
+                ""
+            ))
             results_text.append(entry)
 
         return "\n".join(results_text)
@@ -58,6 +75,26 @@ def perform_online_search_sync(
         return "An error occurred while searching for online sources."
 
 
+def perform_online_search_sync(
+        service: SemanticScholarService,
+        query: str,
+        top_k: int
+) -> str:
+    """
+    Sync shim around perform_online_search for callers without an event loop
+    (query_rag runs it on a worker thread). Async code should await
+    perform_online_search directly instead of paying for a new loop per call.
+    """
+    async def search_and_close() -> str:
+        try:
+            return await perform_online_search(service, query, top_k)
+        finally:
+            # The client is bound to this throwaway loop, so it cannot be reused later
+            await service.aclose()
+
+    return asyncio.run(search_and_close())
+
+
 def query_rag(
         rag_pipeline: RagPipeline,
         retriever: ChromaRagRetriever,
@@ -76,18 +113,29 @@ def query_rag(
         print("✗ RAG pipeline not available")
         return None
 
-    print(f"\n{'=' * 80}")
+    print(f"\n{_SEP}")
     print(f"Query: {question}")
-    print(f"{'=' * 80}\n")
+    print(f"{_SEP}\n")
+
+    # Fire the online search speculatively so it overlaps with local retrieval and
+    # generation; the result is only used if the answer reports needs_search.
+    search_future = None
+    if search_for_new_context:
+        search_future = _online_search_executor.submit(
+            perform_online_search_sync,
+            service=rec_service,
+            query=question,
+            top_k=top_k_results
+        )
 
     # 1. Retrieve context
     retrieved_docs = retriever.get_relevant_documents(question, k=top_k)
     print(f"Retrieved {len(retrieved_docs)} chunks\n")
 
     if show_context:
-        print(f"{'=' * 80}")
+        print(f"{_SEP}")
         print("CONTEXT")
-        print(f"{'=' * 80}")
+        print(f"{_SEP}")
         for i, doc in enumerate(retrieved_docs):
             print(f"\n[{i + 1}] {doc.metadata.get('section', 'N/A')}")
             print(f"{doc.page_content[:200]}...\n")
@@ -96,15 +144,15 @@ def query_rag(
     try:
         response = rag_pipeline.run(question, k=top_k, include_sources=True)
 
-        print(f"{'=' * 80}")
+        print(f"{_SEP}")
         print("ANSWER")
-        print(f"{'=' * 80}\n")
+        print(f"{_SEP}\n")
         print(response.answer)
 
         if show_sources and hasattr(response, 'sources'):
-            print(f"\n{'=' * 80}")
+            print(f"\n{_SEP}")
             print("SOURCES")
-            print(f"{'=' * 80}")
+            print(f"{_SEP}")
             for i, source in enumerate(response.sources):
                 title = source.metadata.get('title', 'Unknown')
                 # Truncate title if it's too long
@@ -113,24 +161,23 @@ def query_rag(
 
                 print(f"\n[{i + 1}] {title}")
                 print(f"    Section: {source.metadata.get('section', 'N/A')}")
-            print(f"{'=' * 80}\n")
+            print(f"{_SEP}\n")
 
-        # 3. Handle async search synchronously via Wrapper
-        if search_for_new_context and getattr(response, 'needs_search', False):
-            print(f"DEBUG: Triggering online search for {top_k_results} papers...")
+        # 3. Use the speculative online search if the answer needs it
+        if search_future is not None and getattr(response, 'needs_search', False):
+            print(f"DEBUG: Using online search for {top_k_results} papers...")
 
-            new_answer_text = perform_online_search_sync(
-                service=rec_service,
-                query=question,
-                top_k=top_k_results
-            )
+            new_answer_text = search_future.result()
 
             response.answer = new_answer_text
 
-            print(f"{'=' * 80}")
+            print(f"{_SEP}")
             print("NEW ANSWER (Enhanced with Online Search)")
-            print(f"{'=' * 80}\n")
+            print(f"{_SEP}\n")
             print(response.answer)
+        elif search_future is not None:
+            # Not needed; drop it if it has not started yet
+            search_future.cancel()
 
         return response
 
@@ -148,7 +195,10 @@ def ingest_pdf(
         model_key: str = "bert",
         zotero_loader: ZoteroClient = None,
         max_chunk_size: int = 500,
-        overlap_size: int = 50
+        overlap_size: int = 50,
+        upsert_batch_size: Optional[int] = None,
+        encode_batch_size: Optional[int] = None,
+        shard_size: int = 1024
 ) -> int:
     """
     Ingest single PDF: Process → Chunk → Embed → Store.
@@ -163,24 +213,195 @@ def ingest_pdf(
         zotero_loader: Optional service to fetch Zotero metadata.
         max_chunk_size: Maximum characters per chunk.
         overlap_size: Overlap characters between chunks.
+        upsert_batch_size: Chunks per DB write (default: the db_service's upsert_batch_size).
+        encode_batch_size: Texts per forward pass (default: the embedder's own batch size).
+        shard_size: Chunks embedded and stored per step, bounding how many embeddings
+            are held in memory at once for very large documents.
 
     Returns:
         int: Number of chunks ingested.
     """
+    docs, metas, ids = _extract_chunks(
+        pdf_path, processor, create_chunks_func, zotero_loader, max_chunk_size, overlap_size
+    )
+    if not docs:
+        return 0
+
+    return _store_chunks(
+        docs, metas, ids, db_service, embedder, model_key, upsert_batch_size, encode_batch_size, shard_size
+    )
+
+
+def ingest_pdfs(
+        pdf_paths: List[Path],
+        processor: DoclingPDFProcessor,
+        db_service: VectorDBService,
+        embedder: Any,
+        create_chunks_func: Callable,
+        model_key: str = "bert",
+        zotero_loader: ZoteroClient = None,
+        max_chunk_size: int = 500,
+        overlap_size: int = 50,
+        upsert_batch_size: Optional[int] = None,
+        encode_batch_size: Optional[int] = None,
+        shard_size: int = 1024
+) -> int:
+    """
+    Ingest several PDFs: one batched Docling conversion (processor.process_pdfs), then
+    Chunk → Embed → Store per PDF as each conversion finishes. Takes the same
+    arguments as ingest_pdf; PDFs that fail to convert are skipped.
+
+    Returns:
+        int: Total number of chunks ingested.
+    """
+    zotero_metas = [_lookup_zotero_metadata(pdf_path, zotero_loader) for pdf_path in pdf_paths]
+
+    total_chunks = 0
+    converted = processor.process_pdfs([str(pdf_path) for pdf_path in pdf_paths], zotero_metadata=zotero_metas)
+    for file_path, metadata, sections in converted:
+        pdf_path = Path(file_path)
+        print(f"\nProcessing: {pdf_path.name}")
+        docs, metas, ids = _chunk_sections(
+            pdf_path, metadata, sections, create_chunks_func, max_chunk_size, overlap_size
+        )
+        if not docs:
+            continue
+
+        total_chunks += _store_chunks(
+            docs, metas, ids, db_service, embedder, model_key, upsert_batch_size, encode_batch_size, shard_size
+        )
+    return total_chunks
+
+
+def _store_chunks(
+        docs: List[str],
+        metas: List[Dict[str, Any]],
+        ids: List[str],
+        db_service: VectorDBService,
+        embedder: Any,
+        model_key: str,
+        upsert_batch_size: Optional[int],
+        encode_batch_size: Optional[int],
+        shard_size: int
+) -> int:
+    """Embed → Store stage of ingest_pdf, ingest_pdfs and ingest_pdfs_async. Returns the number of chunks stored."""
+    # Embed → Store one shard at a time; each shard's vectors are released before the next
+    for start in range(0, len(docs), shard_size):
+        end = start + shard_size
+        embeddings = _embed_unique(embedder, docs[start:end], encode_batch_size)
+
+        # Store
+        db_service.upsert_chunks(
+            model_key=model_key,
+            ids=ids[start:end],
+            documents=docs[start:end],
+            embeddings=embeddings,
+            metadata=metas[start:end],
+            batch_size=upsert_batch_size
+        )
+        del embeddings
+
+    print(f"  Ingested {len(docs)} chunks")
+    return len(docs)
+
+
+async def ingest_pdfs_async(
+        pdf_paths: List[Path],
+        processor: DoclingPDFProcessor,
+        db_service: VectorDBService,
+        embedder: Any,
+        create_chunks_func: Callable,
+        model_key: str = "bert",
+        zotero_loader: ZoteroClient = None,
+        max_chunk_size: int = 500,
+        overlap_size: int = 50,
+        upsert_batch_size: Optional[int] = None,
+        encode_batch_size: Optional[int] = None,
+        shard_size: int = 1024,
+        max_concurrency: int = 2
+) -> int:
+    """
+    Ingests several PDFs with their stages overlapping: while one PDF is embedded
+    and written, the next one is already being parsed. Each stage handles one PDF
+    at a time (the converter, the model and the collection are shared), so the
+    overlap is across stages, not within one. Takes the same arguments as ingest_pdf,
+    including shard_size (embeddings are stored shard by shard, as in ingest_pdf).
+
+    Args:
+        max_concurrency: PDFs in flight at once (parsed but not yet stored ones included).
+
+    Returns:
+        int: Total number of chunks ingested.
+    """
+    # Created per call: asyncio primitives bind to the loop they are first used on
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # Embed and store alternate per shard (see _store_chunks), so they share one lock
+    parse_lock, embed_store_lock = asyncio.Lock(), asyncio.Lock()
+
+    async def ingest_one(pdf_path: Path) -> int:
+        async with semaphore:
+            async with parse_lock:
+                docs, metas, ids = await asyncio.to_thread(
+                    _extract_chunks,
+                    pdf_path, processor, create_chunks_func, zotero_loader, max_chunk_size, overlap_size
+                )
+            if not docs:
+                return 0
+
+            async with embed_store_lock:
+                return await asyncio.to_thread(
+                    _store_chunks,
+                    docs, metas, ids, db_service, embedder, model_key,
+                    upsert_batch_size, encode_batch_size, shard_size
+                )
+
+    counts = await asyncio.gather(*(ingest_one(pdf_path) for pdf_path in pdf_paths))
+    return sum(counts)
+
+
+def _extract_chunks(
+        pdf_path: Path,
+        processor: DoclingPDFProcessor,
+        create_chunks_func: Callable,
+        zotero_loader: Optional[ZoteroClient],
+        max_chunk_size: int,
+        overlap_size: int
+) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+    """Process → Chunk stage of ingest_pdf. Returns (docs, metas, ids); empty if nothing was chunked."""
     print(f"\nProcessing: {pdf_path.name}")
 
     # Try Zotero metadata first
-    zotero_meta = None
-    if zotero_loader:
-        zotero_meta = zotero_loader.get_metadata_by_filename(pdf_path.name)
-        if zotero_meta:
-            print(f"  Using Zotero metadata: '{zotero_meta['title'][:50]}...'")
-        else:
-            print(f"  Warning: No Zotero match - using Docling extraction")
+    zotero_meta = _lookup_zotero_metadata(pdf_path, zotero_loader)
 
     # Process PDF
     # Note: Ensure the processor passed in has a process_pdf method
     metadata, sections = processor.process_pdf(str(pdf_path), zotero_metadata=zotero_meta)
+
+    return _chunk_sections(pdf_path, metadata, sections, create_chunks_func, max_chunk_size, overlap_size)
+
+
+def _lookup_zotero_metadata(pdf_path: Path, zotero_loader: Optional[ZoteroClient]) -> Optional[Dict[str, Any]]:
+    """Zotero metadata for a PDF by filename, or None (Docling's heuristics are used instead)."""
+    if not zotero_loader:
+        return None
+
+    zotero_meta = zotero_loader.get_metadata_by_filename(pdf_path.name)
+    if zotero_meta:
+        print(f"  Using Zotero metadata: '{zotero_meta['title'][:50]}...'")
+    else:
+        print(f"  Warning: No Zotero match for {pdf_path.name} - using Docling extraction")
+    return zotero_meta
+
+
+def _chunk_sections(
+        pdf_path: Path,
+        metadata: Dict[str, Any],
+        sections: Dict[str, str],
+        create_chunks_func: Callable,
+        max_chunk_size: int,
+        overlap_size: int
+) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+    """Chunk stage shared by _extract_chunks and ingest_pdfs."""
     print(f"  Extracted {len(sections)} sections")
 
     # Create chunks
@@ -195,20 +416,24 @@ def ingest_pdf(
 
     if not docs:
         print("  Error: No chunks created")
-        return 0
+    return docs, metas, ids
 
-    # Embed and store
-    embeddings = embedder.encode(docs)
-    db_service.upsert_chunks(
-        model_key=model_key,
-        ids=ids,
-        documents=docs,
-        embeddings=embeddings.tolist(),
-        metadata=metas
-    )
 
-    print(f"  Ingested {len(docs)} chunks")
-    return len(docs)
+def _embed_unique(embedder: Any, docs: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+    """
+    Embed stage of ingest_pdf: one row per doc, each distinct text encoded once.
+    The embedders length-sort internally, so docs are passed in chunk order.
+    """
+    # Embed each distinct text once (repeated boilerplate, overlap-only chunks),
+    # then scatter the vectors back to every chunk that shares the text
+    unique_index = {}
+    inverse = [unique_index.setdefault(doc, len(unique_index)) for doc in docs]
+    encode_kwargs = {"batch_size": batch_size} if batch_size else {}
+    embeddings = embedder.encode(list(unique_index), **encode_kwargs)
+    if len(unique_index) < len(docs):
+        print(f"  Skipped {len(docs) - len(unique_index)} duplicate chunks during embedding")
+        embeddings = embeddings[inverse]
+    return embeddings
 
 
 def load_eval_dataset(filename: str = "eval_dataset.json") -> List[Dict[str, Any]]:
@@ -220,8 +445,12 @@ def load_eval_dataset(filename: str = "eval_dataset.json") -> List[Dict[str, Any
         file_path = directory / filename
         if file_path.exists():
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
+                if orjson is not None:
+                    # Parses the raw bytes directly; its JSONDecodeError subclasses json's
+                    data = orjson.loads(file_path.read_bytes())
+                else:
+                    with open(file_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
                 print(f"Loaded {len(data)} questions from {file_path}")
                 return data
             except json.JSONDecodeError as e:
@@ -260,21 +489,21 @@ def show_llm_prompt(
 
     formatted_prompt = prompt_template.format_messages(question=question, context=context)
 
-    print(f"{'=' * 80}")
+    print(f"{_SEP}")
     print(f"EXACT PROMPT SENT TO LLM")
-    print(f"{'=' * 80}")
+    print(f"{_SEP}")
     print(f"Template: {template_name} | Retrieved chunks: {len(retrieved_docs)} | Context: {len(context)} chars\n")
 
     for i, msg in enumerate(formatted_prompt):
         role = msg.__class__.__name__.replace('Message', '').upper()
-        print(f"\n{'=' * 80}")
+        print(f"\n{_SEP}")
         print(f"MESSAGE {i + 1}: {role}")
-        print(f"{'=' * 80}\n")
+        print(f"{_SEP}\n")
         print(msg.content)
 
-    print(f"\n{'=' * 80}")
+    print(f"\n{_SEP}")
     print(f"Total prompt length: {sum(len(m.content) for m in formatted_prompt)} chars")
-    print(f"{'=' * 80}")
+    print(f"{_SEP}")
 
 
 def log_retrieval_results(
@@ -285,8 +514,11 @@ def log_retrieval_results(
     """
     Formats retrieval results, prints them to console, and optionally saves to a file.
     """
-    # Initialize output with header
-    output_lines = [f"QUERY: {query}\n", "=" * 80 + "\nRETRIEVAL RESULTS\n" + "=" * 80 + "\n"]
+    # Initialize output with header; entries are appended to one buffer
+    # (each preceded by the newline a final join would have inserted)
+    buffer = io.StringIO()
+    buffer.write(f"QUERY: {query}\n")
+    buffer.write(f"\n{_SEP}\nRETRIEVAL RESULTS\n{_SEP}\n")
 
     # Check if results exist
     if not results.get('ids') or not results['ids'][0]:
@@ -294,31 +526,32 @@ def log_retrieval_results(
         print(msg)
         return msg
 
-    # Loop through results
-    for i in range(len(results['ids'][0])):
-        chunk_id = results['ids'][0][i]
-        distance = results['distances'][0][i]
-        content = results['documents'][0][i]
+    # Loop through the first query's columns in step
+    columns = zip(
+        results['ids'][0], results['distances'][0], results['documents'][0], results['metadatas'][0]
+    )
+    for rank, (chunk_id, distance, content, meta) in enumerate(columns, 1):
         # Handle None metadata safely
-        meta = results['metadatas'][0][i] if results['metadatas'][0][i] else {}
+        meta = meta or {}
 
         chunk_output = f"""
-{'=' * 80}
-Rank {i + 1} | Distance: {distance:.4f}
-{'=' * 80}
+{_SEP}
+Rank {rank} | Distance: {distance:.4f}
+{_SEP}
 ID:      {chunk_id}
 Section: {meta.get('section', 'N/A')}
 Paper:   {meta.get('title', 'N/A')}
 Authors: {meta.get('authors', 'N/A')}
 
 Content ({len(content)} chars):
-{'-' * 80}
+{_RULE}
 {content}
 """
         print(chunk_output)
-        output_lines.append(chunk_output)
+        buffer.write("\n")
+        buffer.write(chunk_output)
 
-    full_output = "\n".join(output_lines)
+    full_output = buffer.getvalue()
 
     # Save to file if path provided
     if output_file:
@@ -2,8 +2,42 @@ import json
 import os
 import glob
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-def extract_and_group_sections(input_directory, output_file=None):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _parse_one(file_path):
+    """
+    Parses one paper JSON. Runs in a worker process, so it is a top-level function.
+    Returns (paper_title, filename, [(section_title, content), ...]) or None on error.
+    """
+    try:
+        if orjson is not None:
+            # orjson parses straight from bytes, skipping the str decode
+            with open(file_path, 'rb') as f:
+                data = orjson.loads(f.read())
+        else:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+
+        # Extract metadata for context
+        paper_title = data.get('metadata', {}).get('title', 'Unknown Title')
+        filename = data.get('filename', os.path.basename(file_path))
+
+        # Extract sections
+        sections = data.get('sections', {})
+        return paper_title, filename, list(sections.items())
+
+    except Exception as e:
+        print(f"Error reading {file_path}: {e}")
+        return None
+
+
+def extract_and_group_sections(input_directory, output_file=None, max_workers=None):
     """
     Reads all JSON files in the input_directory, extracts content from the 'sections'
     key, and groups them by section title.
@@ -12,6 +46,8 @@ def extract_and_group_sections(input_directory, output_file=None):
         input_directory (str): Path to the folder containing JSON files.
         output_file (str, optional): Path to save the grouped JSON output. 
                                      If None, prints to console.
+        max_workers (int, optional): Processes used to parse the files (default: CPU count).
+                                     1 parses serially in this process.
     """
     # Dictionary to hold grouped content: { "Section Name": [ { "paper": "Title", "content": "..." }, ... ] }
     grouped_sections = defaultdict(list)
@@ -25,31 +61,32 @@ def extract_and_group_sections(input_directory, output_file=None):
 
     print(f"Processing {len(json_files)} files...")
 
-    for file_path in json_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
-                # Extract metadata for context
-                paper_title = data.get('metadata', {}).get('title', 'Unknown Title')
-                filename = data.get('filename', os.path.basename(file_path))
-                
-                # Extract sections
-                sections = data.get('sections', {})
-                
-                for section_title, section_content in sections.items():
-                    # Create a record for this section entry
-                    entry = {
-                        "paper_title": paper_title,
-                        "source_filename": filename,
-                        "content": section_content
-                    }
-                    
-                    # Group by the section title
-                    grouped_sections[section_title].append(entry)
-                    
-        except Exception as e:
-            print(f"Error reading {file_path}: {e}")
+    # Parsing is independent per file; map() keeps the file order for the merge below
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers != 1 else None
+    if executor is not None:
+        parsed = executor.map(_parse_one, json_files, chunksize=32)
+    else:
+        parsed = map(_parse_one, json_files)
+
+    try:
+        for result in parsed:
+            if result is None:
+                continue
+            paper_title, filename, sections = result
+
+            for section_title, section_content in sections:
+                # Create a record for this section entry
+                entry = {
+                    "paper_title": paper_title,
+                    "source_filename": filename,
+                    "content": section_content
+                }
+
+                # Group by the section title
+                grouped_sections[section_title].append(entry)
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
     # Output the results
     if output_file:
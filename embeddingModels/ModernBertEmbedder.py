@@ -1,13 +1,69 @@
 import torch
 import torch.nn.functional as F
-from transformers import AutoModel, AutoTokenizer
+from transformers import AutoModel, AutoTokenizer, PreTrainedTokenizerFast
 import numpy as np
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Union, List, Any
 from tqdm import tqdm
 import gc
 
 from embeddingModels.BaseEmbeddingModel import BaseEmbeddingModel
 
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+
+if triton is not None:
+    @triton.jit
+    def _masked_mean_kernel(
+            hidden_ptr, mask_ptr, out_ptr,
+            seq_len, hidden_size,
+            stride_hidden_b, stride_hidden_l, stride_mask_b, stride_out_b,
+            BLOCK_H: tl.constexpr
+    ):
+        # One program per (sequence, block of hidden dims): a single pass over L that
+        # accumulates masked sums and the token count in registers.
+        batch = tl.program_id(0)
+        offsets = tl.program_id(1) * BLOCK_H + tl.arange(0, BLOCK_H)
+        in_bounds = offsets < hidden_size
+
+        acc = tl.zeros((BLOCK_H,), dtype=tl.float32)
+        count = 0.0
+        for pos in range(0, seq_len):
+            m = tl.load(mask_ptr + batch * stride_mask_b + pos).to(tl.float32)
+            # Padding rows are masked out of the load, so they cost no HBM traffic
+            h = tl.load(
+                hidden_ptr + batch * stride_hidden_b + pos * stride_hidden_l + offsets,
+                mask=in_bounds & (m > 0),
+                other=0.0
+            ).to(tl.float32)
+            acc += h
+            count += m
+
+        tl.store(out_ptr + batch * stride_out_b + offsets, acc / tl.maximum(count, 1e-9), mask=in_bounds)
+
+
+def _masked_mean_triton(last_hidden_states: torch.Tensor, attention_mask: torch.Tensor, block_h: int = 128) -> torch.Tensor:
+    """Fused masked mean over the sequence axis: (B, L, H) + (B, L) -> (B, H) in fp32."""
+    hidden = last_hidden_states.contiguous()
+    mask = attention_mask.contiguous()
+    batch_size, seq_len, hidden_size = hidden.shape
+
+    out = torch.empty((batch_size, hidden_size), dtype=torch.float32, device=hidden.device)
+    grid = (batch_size, triton.cdiv(hidden_size, block_h))
+    _masked_mean_kernel[grid](
+        hidden, mask, out,
+        seq_len, hidden_size,
+        hidden.stride(0), hidden.stride(1), mask.stride(0), out.stride(0),
+        BLOCK_H=block_h
+    )
+    return out
+
 
 class ModernBertEmbedder(BaseEmbeddingModel):
 
@@ -16,10 +72,18 @@ class ModernBertEmbedder(BaseEmbeddingModel):
             model_name: str = "answerdotai/ModernBERT-base",
             device: str = None,
             normalize: bool = True,
+            compile_model: bool = False,
+            warmup_tokens: int = 512,
+            query_graph_length: int = 0,
             auto_load: bool = True
     ):
         self.model_name = model_name
         self.normalize = normalize
+        self.compile_model = compile_model
+        self.warmup_tokens = warmup_tokens
+        # > 0: single-text encodes up to this many tokens replay a captured CUDA graph
+        # (opt-in; the graph is only used once it matched the eager path at load time)
+        self.query_graph_length = query_graph_length
 
         if device:
             self.device = device
@@ -33,6 +97,8 @@ class ModernBertEmbedder(BaseEmbeddingModel):
 
         self.model = None
         self.tokenizer = None
+        self._query_graph = None
+        self._graph_lock = threading.Lock()
 
         if auto_load:
             self.load()
@@ -43,12 +109,106 @@ class ModernBertEmbedder(BaseEmbeddingModel):
             return
 
         print(f"Loading {self.model_name} on {self.device}...")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModel.from_pretrained(self.model_name).to(self.device)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, use_fast=True)
+        if not isinstance(self.tokenizer, PreTrainedTokenizerFast):
+            raise RuntimeError(f"No fast (Rust) tokenizer available for {self.model_name}")
+        # SDPA avoids the eager path that materialises a full (B, L, L) attention mask;
+        # low_cpu_mem_usage skips the randomly initialised copy, so loading never holds
+        # a second full-size copy of the weights in CPU memory
+        self.model = AutoModel.from_pretrained(
+            self.model_name,
+            attn_implementation="sdpa",
+            low_cpu_mem_usage=True
+        ).to(self.device)
         self.model.eval()
 
+        if self.compile_model:
+            self.model = torch.compile(self.model, mode="reduce-overhead", fullgraph=False)
+
+        if self.device == 'cuda' and self.warmup_tokens:
+            self._warmup()
+
+        # torch.compile's reduce-overhead mode already records its own CUDA graphs
+        if self.device == 'cuda' and self.query_graph_length and not self.compile_model:
+            self._capture_query_graph()
+
+    def _warmup(self, batch_size: int = 16) -> None:
+        """Runs one large dummy batch so later encodes reuse already-reserved CUDA blocks."""
+        self.encode(["x " * self.warmup_tokens] * batch_size, batch_size=batch_size)
+
+    def _capture_query_graph(self) -> None:
+        """
+        Captures the forward pass for one sequence padded to query_graph_length.
+        At batch size 1 the forward is dominated by kernel launch overhead, which
+        a graph replay collapses into a single launch.
+        """
+        length = self.query_graph_length
+        self._graph_ids = torch.full((1, length), self.tokenizer.pad_token_id, dtype=torch.long, device=self.device)
+        # Capture with padding in the mask: an all-ones mask lets the attention-mask
+        # preparation drop the mask altogether, and the replay would then attend to pads
+        self._graph_mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+        self._graph_mask[0, length // 2:] = 0
+
+        try:
+            with torch.no_grad():
+                # Warm up on a side stream first, as CUDA graph capture requires
+                side_stream = torch.cuda.Stream()
+                side_stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(side_stream):
+                    for _ in range(3):
+                        self.model(input_ids=self._graph_ids, attention_mask=self._graph_mask)
+                torch.cuda.current_stream().wait_stream(side_stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    outputs = self.model(input_ids=self._graph_ids, attention_mask=self._graph_mask)
+            self._graph_hidden = outputs.last_hidden_state
+            self._query_graph = graph
+        except Exception as e:
+            print(f"CUDA graph capture failed, using eager query path: {e}")
+            self._query_graph = None
+            return
+
+        if not self._query_graph_matches_eager():
+            print("CUDA graph output differs from the eager path for a padded query, using eager query path.")
+            self._query_graph = None
+
+    def _query_graph_matches_eager(self, text: str = "Which methods align X-ray mirrors automatically?") -> bool:
+        """Encodes one short (i.e. padded) query with the graph and eagerly and compares the two."""
+        input_ids = self.tokenizer(text, truncation=True)['input_ids']
+        if len(input_ids) >= self.query_graph_length:
+            return False
+
+        graph_vector = self._encode_with_graph(input_ids)
+        # encode() only takes the graph path when one is set
+        graph, self._query_graph = self._query_graph, None
+        try:
+            eager_vector = self.encode([text])
+        finally:
+            self._query_graph = graph
+        return np.allclose(graph_vector, eager_vector, atol=1e-3)
+
+    def _encode_with_graph(self, input_ids: List[int]) -> np.ndarray:
+        """Encodes one pre-tokenized text by replaying the captured query graph."""
+        n = len(input_ids)
+        with self._graph_lock, torch.no_grad():
+            # Pooling runs outside the graph: embedding_bag's nonzero() is not capturable
+            self._graph_ids.fill_(self.tokenizer.pad_token_id)
+            self._graph_ids[0, :n] = torch.tensor(input_ids, dtype=torch.long, device=self.device)
+            self._graph_mask.zero_()
+            self._graph_mask[0, :n] = 1
+
+            self._query_graph.replay()
+            embeddings = self._mean_pooling(self._graph_hidden, self._graph_mask)
+
+            if self.normalize:
+                embeddings = F.normalize(embeddings, p=2, dim=1)
+
+            return embeddings.cpu().numpy()
+
     def unload(self) -> None:
         print(f"Unloading {self.model_name}...")
+        self._query_graph = None
         if self.model is not None:
             del self.model
             self.model = None
@@ -78,10 +238,49 @@ class ModernBertEmbedder(BaseEmbeddingModel):
         return self.model.config.hidden_size
 
     def _mean_pooling(self, last_hidden_states: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
-        input_mask_expanded = attention_mask.unsqueeze(-1).expand(last_hidden_states.size()).float()
-        sum_embeddings = torch.sum(last_hidden_states * input_mask_expanded, 1)
-        sum_mask = torch.clamp(input_mask_expanded.sum(1), min=1e-9)
-        return sum_embeddings / sum_mask
+        if triton is not None and last_hidden_states.is_cuda:
+            return _masked_mean_triton(last_hidden_states, attention_mask)
+
+        # Treat every sequence as a "bag" of its non-padding token rows and let
+        # embedding_bag do gather + sum + divide in one kernel. This avoids
+        # materialising a (B, L, H) mask and never touches padding tokens.
+        seq_len, hidden_size = last_hidden_states.shape[1], last_hidden_states.shape[2]
+        mask = attention_mask.bool()
+
+        # nonzero() is row-major, so token indices come out grouped by sequence
+        batch_idx, token_idx = mask.nonzero(as_tuple=True)
+        flat_indices = batch_idx * seq_len + token_idx
+
+        lengths = mask.sum(dim=1)
+        offsets = torch.zeros_like(lengths)
+        offsets[1:] = lengths.cumsum(0)[:-1]
+
+        return F.embedding_bag(
+            flat_indices,
+            last_hidden_states.reshape(-1, hidden_size),
+            offsets,
+            mode="mean"
+        )
+
+    def _prepare_batch(self, encodings, batch_idx: np.ndarray, h2d_stream=None):
+        """
+        Pads one length-sorted batch and starts its host-to-device copy.
+        Returns (inputs, copy_done_event); the event is None off-CUDA.
+        """
+        inputs = self.tokenizer.pad(
+            {key: [encodings[key][j] for j in batch_idx] for key in encodings.keys()},
+            padding=True,
+            return_tensors='pt'
+        )
+        if h2d_stream is None:
+            return inputs.to(self.device), None
+
+        # Pinned sources on a dedicated stream let the copy overlap the running forward pass
+        with torch.cuda.stream(h2d_stream):
+            device_inputs = {key: value.pin_memory().to(self.device, non_blocking=True) for key, value in inputs.items()}
+            copy_done = torch.cuda.Event()
+            copy_done.record(h2d_stream)
+        return device_inputs, copy_done
 
     def encode(self, texts: Union[str, List[str]], batch_size: int = 16, show_progress: bool = False) -> np.ndarray:
         # Auto-load check
@@ -91,21 +290,51 @@ class ModernBertEmbedder(BaseEmbeddingModel):
         if isinstance(texts, str):
             texts = [texts]
 
-        all_embeddings = []
-        iterator = range(0, len(texts), batch_size)
+        if not texts:
+            return np.array([])
+
+        if self._query_graph is not None and len(texts) == 1:
+            input_ids = self.tokenizer(texts[0], truncation=True)['input_ids']
+            if len(input_ids) <= self.query_graph_length:
+                return self._encode_with_graph(input_ids)
+
+        # Tokenize once and encode in length-sorted order, so every batch is only
+        # padded to the longest text it actually contains.
+        encodings = self.tokenizer(texts, truncation=True)
+        order = np.argsort([len(ids) for ids in encodings['input_ids']], kind='stable')
+        batches = [order[i: i + batch_size] for i in range(0, len(texts), batch_size)]
+
+        # Batches are written straight into their (unsorted) rows of the output,
+        # so there is no per-batch list, final vstack or reordering copy.
+        embeddings_out = np.empty((len(texts), self.dimension), dtype=np.float32)
+        iterator = range(len(batches))
 
         if show_progress:
             iterator = tqdm(iterator, desc="Encoding", unit="batch")
 
-        with torch.no_grad():
-            for i in iterator:
-                batch = texts[i: i + batch_size]
-                inputs = self.tokenizer(
-                    batch,
-                    padding=True,
-                    truncation=True,
-                    return_tensors='pt'
-                ).to(self.device)
+        # Three-stage pipeline: while batch b runs on the compute stream, batch b + 1
+        # is being copied on the H2D stream and batch b + 2 is padded on the CPU.
+        h2d_stream = torch.cuda.Stream() if self.device == 'cuda' else None
+        prefetch_depth = 2
+
+        with ThreadPoolExecutor(max_workers=1) as executor, torch.no_grad():
+            prepared = deque(
+                executor.submit(self._prepare_batch, encodings, batches[b], h2d_stream)
+                for b in range(min(prefetch_depth, len(batches)))
+            )
+            for b in iterator:
+                inputs, copy_done = prepared.popleft().result()
+                if b + prefetch_depth < len(batches):
+                    prepared.append(
+                        executor.submit(self._prepare_batch, encodings, batches[b + prefetch_depth], h2d_stream)
+                    )
+
+                if copy_done is not None:
+                    compute_stream = torch.cuda.current_stream()
+                    compute_stream.wait_event(copy_done)
+                    # Inputs were allocated on the H2D stream but are consumed here
+                    for value in inputs.values():
+                        value.record_stream(compute_stream)
 
                 outputs = self.model(**inputs)
                 embeddings = self._mean_pooling(outputs.last_hidden_state, inputs['attention_mask'])
@@ -113,11 +342,6 @@ class ModernBertEmbedder(BaseEmbeddingModel):
                 if self.normalize:
                     embeddings = F.normalize(embeddings, p=2, dim=1)
 
-                all_embeddings.append(embeddings.cpu().numpy())
-
-                del inputs, outputs, embeddings
-
-        if not all_embeddings:
-            return np.array([])
+                embeddings_out[batches[b]] = embeddings.cpu().numpy()
 
-        return np.vstack(all_embeddings)
\ No newline at end of file
+        return embeddings_out
\ No newline at end of file
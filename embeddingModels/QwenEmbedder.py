@@ -1,10 +1,13 @@
-from typing import Union, List
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, List, Optional
 
 import numpy as np
 import torch
 import torch.nn.functional as F
 from tqdm import tqdm
-from transformers import AutoModel, AutoTokenizer
+from transformers import AutoModel, AutoTokenizer, BitsAndBytesConfig, PreTrainedTokenizerFast
 import gc
 
 from embeddingModels.BaseEmbeddingModel import BaseEmbeddingModel
@@ -17,15 +20,27 @@ class QwenEmbedder(BaseEmbeddingModel):
             device: str = None,
             normalize: bool = True,
             use_fp16: bool = True,
+            quantization: Optional[str] = None,
+            compile_model: bool = False,
+            warmup_tokens: int = 512,
             auto_load: bool = True
     ):
         """
         Args:
+            quantization: Optional bitsandbytes weight quantization, "int8" or "nf4" (CUDA only).
+            compile_model: If True, wraps the model with torch.compile after loading.
+            warmup_tokens: Length of the dummy batch run after loading on CUDA (0 disables).
             auto_load: If True, loads the model immediately on initialization.
         """
+        if quantization not in (None, "int8", "nf4"):
+            raise ValueError(f"Unknown quantization: {quantization}")
+
         self.model_name = model_name
         self.normalize = normalize
         self.use_fp16 = use_fp16  # Stored for use in load()
+        self.quantization = quantization
+        self.compile_model = compile_model
+        self.warmup_tokens = warmup_tokens
 
         if device:
             self.device = device
@@ -47,7 +62,9 @@ class QwenEmbedder(BaseEmbeddingModel):
         print(f"Loading {self.model_name} on {self.device}...")
 
         # 1. Load Tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, trust_remote_code=True)
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, use_fast=True, trust_remote_code=True)
+        if not isinstance(self.tokenizer, PreTrainedTokenizerFast):
+            raise RuntimeError(f"No fast (Rust) tokenizer available for {self.model_name}")
         self.tokenizer.padding_side = 'left'
 
         if self.tokenizer.pad_token is None:
@@ -56,14 +73,58 @@ class QwenEmbedder(BaseEmbeddingModel):
         # 2. Load Model
         torch_dtype = torch.float16 if self.use_fp16 else torch.float32
 
-        self.model = AutoModel.from_pretrained(
-            self.model_name,
-            trust_remote_code=True,
-            torch_dtype=torch_dtype
-        ).to(self.device)
+        # Prefer FlashAttention-2 when it is installed (CUDA + fp16 only), else SDPA
+        attn_implementation = "sdpa"
+        if self.device == 'cuda' and self.use_fp16 and importlib.util.find_spec("flash_attn") is not None:
+            attn_implementation = "flash_attention_2"
+
+        if self.quantization:
+            if self.device != 'cuda':
+                raise ValueError("bitsandbytes quantization requires a CUDA device")
+
+            # Weight-only quantization halves (int8) or quarters (nf4) the bytes read per matmul
+            if self.quantization == "int8":
+                quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+            else:
+                quantization_config = BitsAndBytesConfig(
+                    load_in_4bit=True,
+                    bnb_4bit_quant_type="nf4",
+                    bnb_4bit_compute_dtype=torch_dtype
+                )
+
+            # Quantized weights are placed at load time and cannot be moved with .to()
+            self.model = AutoModel.from_pretrained(
+                self.model_name,
+                trust_remote_code=True,
+                torch_dtype=torch_dtype,
+                attn_implementation=attn_implementation,
+                quantization_config=quantization_config,
+                device_map=self.device
+            )
+        else:
+            # low_cpu_mem_usage loads the checkpoint straight into the model instead of first
+            # building a randomly initialised copy, so loading never holds a second
+            # full-size copy of the weights in CPU memory (the cast and .to() still copy).
+            self.model = AutoModel.from_pretrained(
+                self.model_name,
+                trust_remote_code=True,
+                torch_dtype=torch_dtype,
+                attn_implementation=attn_implementation,
+                low_cpu_mem_usage=True
+            ).to(self.device)
 
         self.model.eval()
 
+        if self.compile_model:
+            self.model = torch.compile(self.model, mode="reduce-overhead", fullgraph=False)
+
+        if self.device == 'cuda' and self.warmup_tokens:
+            self._warmup()
+
+    def _warmup(self, batch_size: int = 4) -> None:
+        """Runs one large dummy batch so later encodes reuse already-reserved CUDA blocks."""
+        self.encode(["x " * self.warmup_tokens] * batch_size, batch_size=batch_size)
+
     def unload(self) -> None:
         """Unloads model to free VRAM."""
         print(f"Unloading {self.model_name}...")
@@ -98,7 +159,31 @@ class QwenEmbedder(BaseEmbeddingModel):
         return self.model.config.hidden_size
 
     def _last_token_pooling(self, last_hidden_states: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
-        return last_hidden_states[:, -1, :]
+        # Position of the last real token per row, valid for left and right padding alike
+        seq_len, hidden_size = last_hidden_states.shape[1], last_hidden_states.shape[2]
+        last_idx = seq_len - 1 - attention_mask.flip(dims=[1]).argmax(dim=1)
+        index = last_idx.view(-1, 1, 1).expand(-1, 1, hidden_size)
+        return last_hidden_states.gather(1, index).squeeze(1)
+
+    def _prepare_batch(self, encodings, batch_idx: np.ndarray, h2d_stream=None):
+        """
+        Pads one length-sorted batch and starts its host-to-device copy.
+        Returns (inputs, copy_done_event); the event is None off-CUDA.
+        """
+        inputs = self.tokenizer.pad(
+            {key: [encodings[key][j] for j in batch_idx] for key in encodings.keys()},
+            padding=True,
+            return_tensors='pt'
+        )
+        if h2d_stream is None:
+            return inputs.to(self.device), None
+
+        # Pinned sources on a dedicated stream let the copy overlap the running forward pass
+        with torch.cuda.stream(h2d_stream):
+            device_inputs = {key: value.pin_memory().to(self.device, non_blocking=True) for key, value in inputs.items()}
+            copy_done = torch.cuda.Event()
+            copy_done.record(h2d_stream)
+        return device_inputs, copy_done
 
     def encode(self,
                texts: Union[str, List[str]],
@@ -113,26 +198,65 @@ class QwenEmbedder(BaseEmbeddingModel):
         if isinstance(texts, str):
             texts = [texts]
 
+        if not texts:
+            return np.array([])
+
         if instruction:
             texts = [f"{instruction}{t}" for t in texts]
 
-        all_embeddings = []
-        iterator = range(0, len(texts), batch_size)
+        # Tokenize once and encode in length-sorted order, so a long document never
+        # forces a batch of short snippets to be padded to its length.
+        encodings = self.tokenizer(texts, truncation=True, max_length=8192)
+        order = np.argsort([len(ids) for ids in encodings['input_ids']], kind='stable')
+        batches = [order[i: i + batch_size] for i in range(0, len(texts), batch_size)]
+
+        # Batches are written straight into their (unsorted) rows of the output,
+        # so there is no per-batch list, final vstack or reordering copy.
+        out_dtype = torch.float16 if self.use_fp16 else torch.float32
+        embeddings_out = np.empty(
+            (len(texts), self.dimension),
+            dtype=np.float16 if self.use_fp16 else np.float32
+        )
+        iterator = range(len(batches))
 
         if show_progress:
             iterator = tqdm(iterator, desc="Encoding (Qwen)", unit="batch")
 
-        with torch.no_grad():
-            for i in iterator:
-                batch_texts = texts[i: i + batch_size]
-
-                inputs = self.tokenizer(
-                    batch_texts,
-                    padding=True,
-                    truncation=True,
-                    max_length=8192,
-                    return_tensors='pt'
-                ).to(self.device)
+        # Input pipeline: while batch b runs on the compute stream, batch b + 1 is
+        # being copied on the H2D stream and batch b + 2 is padded on the CPU.
+        h2d_stream = torch.cuda.Stream() if self.device == 'cuda' else None
+        prefetch_depth = 2
+
+        # On CUDA, results are copied to a pinned host buffer on a side stream and
+        # only read back one iteration later, so the D2H transfer of batch i
+        # overlaps with the forward pass of batch i + 1. Embeddings stay in the
+        # model dtype (fp16 by default): after L2 normalisation the precision loss
+        # is negligible for cosine scoring and the transfer is half the size.
+        use_async_copy = self.device == 'cuda'
+        if use_async_copy:
+            pinned = torch.empty((batch_size, self.dimension), dtype=out_dtype, pin_memory=True)
+            copy_stream = torch.cuda.Stream()
+        pending = None  # (copy_done_event, batch_idx) of the batch still in flight
+
+        with ThreadPoolExecutor(max_workers=1) as executor, torch.no_grad():
+            prepared = deque(
+                executor.submit(self._prepare_batch, encodings, batches[b], h2d_stream)
+                for b in range(min(prefetch_depth, len(batches)))
+            )
+            for b in iterator:
+                batch_idx = batches[b]
+                inputs, copy_done = prepared.popleft().result()
+                if b + prefetch_depth < len(batches):
+                    prepared.append(
+                        executor.submit(self._prepare_batch, encodings, batches[b + prefetch_depth], h2d_stream)
+                    )
+
+                if copy_done is not None:
+                    compute_stream = torch.cuda.current_stream()
+                    compute_stream.wait_event(copy_done)
+                    # Inputs were allocated on the H2D stream but are consumed here
+                    for value in inputs.values():
+                        value.record_stream(compute_stream)
 
                 outputs = self.model(**inputs)
                 embeddings = self._last_token_pooling(outputs.last_hidden_state, inputs['attention_mask'])
@@ -140,12 +264,28 @@ class QwenEmbedder(BaseEmbeddingModel):
                 if self.normalize:
                     embeddings = F.normalize(embeddings, p=2, dim=1)
 
-                all_embeddings.append(embeddings.cpu().to(torch.float32).numpy())
-
-                # Cleanup batch VRAM
-                del inputs, outputs, embeddings
-
-        if not all_embeddings:
-            return np.array([])
-
-        return np.vstack(all_embeddings)
\ No newline at end of file
+                if use_async_copy:
+                    # Drain the previous batch before its staging rows get overwritten
+                    if pending is not None:
+                        done, prev_idx = pending
+                        done.synchronize()
+                        embeddings_out[prev_idx] = pinned[:len(prev_idx)].numpy()
+
+                    rows = embeddings.shape[0]
+                    copy_stream.wait_stream(torch.cuda.current_stream())
+                    with torch.cuda.stream(copy_stream):
+                        pinned[:rows].copy_(embeddings, non_blocking=True)
+                        done = torch.cuda.Event()
+                        done.record(copy_stream)
+                    # Keep the allocator from reusing this memory before the copy finishes
+                    embeddings.record_stream(copy_stream)
+                    pending = (done, batch_idx)
+                else:
+                    embeddings_out[batch_idx] = embeddings.cpu().numpy()
+
+        if pending is not None:
+            done, prev_idx = pending
+            done.synchronize()
+            embeddings_out[prev_idx] = pinned[:len(prev_idx)].numpy()
+
+        return embeddings_out
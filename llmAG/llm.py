@@ -1,4 +1,6 @@
 import os
+from functools import lru_cache
+
 from langchain_ollama import ChatOllama
 
 from llmAG.llm_config import DEFAULT_MODEL, DEFAULT_TEMPERATURE
@@ -8,4 +10,11 @@ def build_llm(model: str = DEFAULT_MODEL, temperature: float = DEFAULT_TEMPERATU
     # # original: return ChatOllama(model=model, temperature=temperature)
     # Use host.docker.internal when running in Docker to reach host services
     base_url = os.getenv("OLLAMA_BASE_URL", "http://host.docker.internal:11434")
+    return _cached_llm(model, temperature, base_url)
+
+
+@lru_cache(maxsize=8)
+def _cached_llm(model: str, temperature: float, base_url: str) -> ChatOllama:
+    # One client per configuration: pipelines built per request (run_rag_answer)
+    # reuse its pooled keep-alive connections to Ollama instead of opening new ones
     return ChatOllama(model=model, temperature=temperature, base_url=base_url)
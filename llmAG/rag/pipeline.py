@@ -10,8 +10,15 @@ Responsibilities:
 Workflow:
 run(question) -> parse optional slash command -> retrieve docs -> choose prompt template
 -> format context -> invoke LLM chain -> return RagResponse with status flags.
+
+Prompt layout: system prompt, then context, then the question. Everything before the
+question stays identical for repeated retrievals, so the LLM server can reuse the
+cached prefix; do not move per-request text ahead of the context.
 """
 
+import hashlib
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Iterable, List, Optional
 
@@ -33,6 +40,38 @@ from llmAG.llm_config import (
 from .retrievers import BaseRetriever
 
 
+# Question last, so system prompt + context form a reusable prefix (see module docstring)
+_CONTEXT_THEN_QUESTION = "Context:\n{context}\n\n---\nQuestion: {question}"
+
+# Parsed once at import: the prompts are constants, so every pipeline (one per
+# request in run_rag_answer) shares the same templates.
+_SYSTEM_PROMPTS = [
+    ("answer", ANSWER_SYSTEM_PROMPT),
+    ("mode_a", MODE_A_SYSTEM_PROMPT),
+    ("mode_b", MODE_B_SYSTEM_PROMPT),
+    ("mode_c", MODE_C_SYSTEM_PROMPT),
+    ("insufficient", INSUFFICIENT_SYSTEM_PROMPT),
+    ("debug", DEBUG_SYSTEM_PROMPT),
+]
+PROMPT_TEMPLATES = {
+    # "insufficient" runs without retrieved docs, so it has no context slot
+    name: ChatPromptTemplate.from_messages(
+        [
+            ("system", system_prompt),
+            ("human", "Question: {question}" if name == "insufficient" else _CONTEXT_THEN_QUESTION),
+        ]
+    )
+    for name, system_prompt in _SYSTEM_PROMPTS
+}
+
+
+# Answers keyed on everything that reaches the LLM (model, temperature, template,
+# question, formatted context). Module level because run_rag_answer builds a new
+# pipeline per request; shared across threads (see the evaluator's concurrency).
+_ANSWER_CACHE_SIZE = 1024
+_answer_cache: "OrderedDict[bytes, str]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
 
 @dataclass
 class RagResponse:
@@ -64,54 +103,23 @@ class RagPipeline:
         self._retriever = retriever
         # LLM factory wrapper to centralize model config
         self._llm = build_llm(model=model, temperature=temperature)
+        self._model = model
+        self._temperature = temperature
         # Context length guard: limits prompt size without tokenizers.
         self._max_context_chars = max_context_chars
 
-        # Cached prompt template and chains to avoid re-creation on each run.
-        self._prompts = {
-            "answer": ChatPromptTemplate.from_messages(
-                [
-                    ("system", ANSWER_SYSTEM_PROMPT),
-                    ("human", "Question: {question}\n\nContext:\n{context}"),
-                ]
-            ),
-            "mode_a": ChatPromptTemplate.from_messages(
-                [
-                    ("system", MODE_A_SYSTEM_PROMPT),
-                    ("human", "Question: {question}\n\nContext:\n{context}"),
-                ]
-            ),
-            "mode_b": ChatPromptTemplate.from_messages(
-                [
-                    ("system", MODE_B_SYSTEM_PROMPT),
-                    ("human", "Question: {question}\n\nContext:\n{context}"),
-                ]
-            ),
-            "mode_c": ChatPromptTemplate.from_messages(
-                [
-                    ("system", MODE_C_SYSTEM_PROMPT),
-                    ("human", "Question: {question}\n\nContext:\n{context}"),
-                ]
-            ),
-            "insufficient": ChatPromptTemplate.from_messages(
-                [
-                    ("system", INSUFFICIENT_SYSTEM_PROMPT),
-                    ("human", "Question: {question}"),
-                ]
-            ),
-            "debug": ChatPromptTemplate.from_messages(
-                [
-                    ("system", DEBUG_SYSTEM_PROMPT),
-                    ("human", "Question: {question}\n\nContext:\n{context}"),
-                ]
-            ),
-        }
+        # Prompt templates are shared module constants; chains depend on the LLM.
+        self._prompts = PROMPT_TEMPLATES
         # Chains are cached on the instance to keep invocation cheap.
         # ChatPromptTemplate | LLM produces a callable chain in LangChain.
         self._chains = {
             name: prompt | self._llm for name, prompt in self._prompts.items()
         }
 
+    @property
+    def retriever(self) -> BaseRetriever:
+        """Retriever used by run(); exposed for evaluation tooling."""
+        return self._retriever
 
     def _format_context(self, docs: Iterable[Document]) -> str:
         """
@@ -119,30 +127,39 @@ class RagPipeline:
         Experimental --> Bit of a Blackbox
         """
         # Assemble a readable context block, truncating to max size.
+        # Pieces (separators included) are joined once at the end, so each snippet is
+        # copied a single time instead of once into its chunk and again by the join.
+        budget = self._max_context_chars
         parts: List[str] = []
         current_len = 0
         for doc in docs:
             header = self._format_header(doc)
             snippet = doc.page_content.strip()
-            chunk = f"{header}\n{snippet}"
-            if self._max_context_chars and current_len + len(chunk) > self._max_context_chars:
+            # Length of "header\nsnippet", known without building it
+            chunk_len = len(header) + 1 + len(snippet)
+            if budget and current_len + chunk_len > budget:
                 # Trim the final chunk to fit the remaining space without splitting mid-word.
-                remaining = self._max_context_chars - current_len
-                if remaining <= 0:
-                    break
-                chunk = self._truncate_chunk(chunk, remaining)
-                if not chunk:
-                    break
-                parts.append(chunk)
-                current_len += len(chunk)
+                chunk = self._truncate_chunk(f"{header}\n{snippet}", budget - current_len)
+                if chunk:
+                    parts.append(chunk)
+                    parts.append("\n\n")
                 break
-            parts.append(chunk)
-            current_len += len(chunk)
-        return "\n\n".join(parts) if parts else "No relevant context found."
+            parts.extend((header, "\n", snippet, "\n\n"))
+            current_len += chunk_len
+        if not parts:
+            return "No relevant context found."
+        # Drop the trailing separator
+        parts.pop()
+        return "".join(parts)
 
     @staticmethod
     def _format_header(doc: Document) -> str:
         """Format a citation header; used by _format_context for each Document."""
+        # Chunks ingested with the current chunker carry the formatted header already
+        if doc.metadata:
+            header = doc.metadata.get("_header")
+            if header:
+                return header
         # Mirror the metadata produced in the PDF pipeline. --> good for debugging
         title = doc.metadata.get("title", "Unknown") if doc.metadata else "Unknown"
         section = doc.metadata.get("section", "Unknown") if doc.metadata else "Unknown"
@@ -165,17 +182,76 @@ class RagPipeline:
             cutoff = remaining
         return chunk[:cutoff].rstrip()
 
-    def run(self, question: str, k: int = 4, include_sources: bool = True) -> RagResponse:
+    def run(self, question: str, k: int = 4, include_sources: bool = True, use_cache: bool = False) -> RagResponse:
         """
         Main entry point; called by API handlers or notebooks.
         Retrieve top-k chunks and feed them into the prompt template.
         Optional slash commands override template selection but do not skip retrieval.
+        With use_cache (off by default), an identical prompt (same template, question and
+        context) reuses the earlier answer instead of calling the LLM again. Answers are
+        sampled, so only enable it where replaying one is acceptable.
         """
         command, cleaned_question = self._parse_command(question)
         docs = self._retriever.get_relevant_documents(cleaned_question, k=k)
         chain_key, payload = self._select_chain(cleaned_question, docs, command)
-        result = self._chains[chain_key].invoke(payload)
-        answer = result.content if hasattr(result, "content") else str(result)
+
+        cache_key = self._cache_key(chain_key, payload) if use_cache else None
+        answer = self._cached_answer(cache_key)
+        if answer is None:
+            answer = self._answer_text(self._chains[chain_key].invoke(payload))
+            self._store_answer(cache_key, answer)
+        return self._build_response(answer, docs, chain_key, include_sources)
+
+    async def arun(self, question: str, k: int = 4, include_sources: bool = True, use_cache: bool = False) -> RagResponse:
+        """
+        Async variant of run(); awaits retrieval and the LLM call instead of blocking,
+        so one event loop can serve several questions at once. Same result as run().
+        """
+        command, cleaned_question = self._parse_command(question)
+        docs = await self._retriever.aget_relevant_documents(cleaned_question, k=k)
+        chain_key, payload = self._select_chain(cleaned_question, docs, command)
+
+        cache_key = self._cache_key(chain_key, payload) if use_cache else None
+        answer = self._cached_answer(cache_key)
+        if answer is None:
+            answer = self._answer_text(await self._chains[chain_key].ainvoke(payload))
+            self._store_answer(cache_key, answer)
+        return self._build_response(answer, docs, chain_key, include_sources)
+
+    def _cache_key(self, chain_key: str, payload: dict) -> bytes:
+        """Hash of everything that determines the LLM input; the context already encodes the retrieved docs."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (self._model, repr(self._temperature), chain_key, payload["question"], payload.get("context", "")):
+            digest.update(part.encode("utf-8"))
+            # Separator byte, so ("ab", "c") and ("a", "bc") never collide
+            digest.update(b"\0")
+        return digest.digest()
+
+    @staticmethod
+    def _cached_answer(cache_key: Optional[bytes]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        with _answer_cache_lock:
+            answer = _answer_cache.get(cache_key)
+            if answer is not None:
+                _answer_cache.move_to_end(cache_key)
+            return answer
+
+    @staticmethod
+    def _store_answer(cache_key: Optional[bytes], answer: str) -> None:
+        if cache_key is None:
+            return
+        with _answer_cache_lock:
+            _answer_cache[cache_key] = answer
+            if len(_answer_cache) > _ANSWER_CACHE_SIZE:
+                _answer_cache.popitem(last=False)
+
+    @staticmethod
+    def _answer_text(result) -> str:
+        return result.content if hasattr(result, "content") else str(result)
+
+    def _build_response(self, answer: str, docs: List[Document], chain_key: str, include_sources: bool) -> RagResponse:
+        """Wrap the answer in a RagResponse with status flags; shared by run and arun."""
         sources = docs if include_sources else None
         status = "insufficient" if chain_key == "insufficient" else "ok"
         needs_search = chain_key == "insufficient"
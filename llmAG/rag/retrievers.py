@@ -2,6 +2,7 @@ from __future__ import annotations
 
 """Retriever interface for the RAG pipeline."""
 
+import asyncio
 from typing import List
 
 from langchain_core.documents import Document
@@ -12,3 +13,7 @@ class BaseRetriever:
 
     def get_relevant_documents(self, query: str, k: int = 4) -> List[Document]:
         raise NotImplementedError
+
+    async def aget_relevant_documents(self, query: str, k: int = 4) -> List[Document]:
+        """Async variant used by RagPipeline.arun; by default runs the sync lookup in a worker thread."""
+        return await asyncio.to_thread(self.get_relevant_documents, query, k)
@@ -6,6 +6,24 @@ Extracts from PDF sections and creates optimally-sized chunks with filtering and
 from typing import Dict, List, Tuple
 
 
+# Low-value sections to skip (based on corpus analysis), compared against the
+# stripped, lower-cased header. Built once at import instead of on every call.
+_SKIP_SECTIONS = frozenset({
+    "preamble", "references", "bibliography",
+    "acknowledgements", "acknowledgments", "acknowledgement",
+    "author contributions", "author contribution",
+    "additional information", "data availability",
+    "code availability", "code and data availability",
+    "competing interests", "competing financial interests",
+    "conflict of interest", "funding information", "funding",
+    "extended author information", "online content",
+    "reporting summary", "article",
+    "reprints and permissions information is available at http://www.nature.com/reprints",
+    "amanda a. volk 1 & milad abolhasani 1",
+    "supplementary information", "supporting information"
+})
+
+
 def create_chunks_from_sections(
     filename: str,
     metadata: dict,
@@ -27,50 +45,43 @@ def create_chunks_from_sections(
     Returns:
         Tuple of (documents, metadatas, ids) ready for ChromaDB insertion
     """
-    # Low-value sections to skip (based on corpus analysis)
-    SKIP_SECTIONS = {
-        "preamble", "references", "bibliography",
-        "acknowledgements", "acknowledgments", "acknowledgement",
-        "author contributions", "author contribution",
-        "additional information", "data availability",
-        "code availability", "code and data availability",
-        "competing interests", "competing financial interests",
-        "conflict of interest", "funding information", "funding",
-        "extended author information", "online content",
-        "reporting summary", "article",
-        "reprints and permissions information is available at http://www.nature.com/reprints",
-        "amanda a. volk 1 & milad abolhasani 1",
-        "supplementary information", "supporting information"
-    }
-    
     def _split_text_hard(text: str, max_size: int) -> List[str]:
         """Hard split text when no natural boundaries exist."""
         if len(text) <= max_size:
             return [text]
         
+        # Walk a cursor over the original text instead of re-slicing the remainder,
+        # so each character is copied once (into its chunk) rather than once per split
         chunks = []
-        remaining = text
+        pos, end = 0, len(text)
+        stripped_end = len(text.rstrip())
         
-        while len(remaining) > max_size:
-            split_point = max_size
+        while end - pos > max_size:
+            window_end = pos + max_size
+            split_point = window_end
             sentence_end = max(
-                remaining.rfind('. ', 0, max_size),
-                remaining.rfind('! ', 0, max_size),
-                remaining.rfind('? ', 0, max_size)
+                text.rfind('. ', pos, window_end),
+                text.rfind('! ', pos, window_end),
+                text.rfind('? ', pos, window_end)
             )
             
-            if sentence_end > max_size * 0.5:
+            # Boundaries are compared relative to the cursor (-1 means not found)
+            if sentence_end - pos > max_size * 0.5:
                 split_point = sentence_end + 1
             else:
-                space_pos = remaining.rfind(' ', 0, max_size)
-                if space_pos > max_size * 0.5:
+                space_pos = text.rfind(' ', pos, window_end)
+                if space_pos - pos > max_size * 0.5:
                     split_point = space_pos
             
-            chunks.append(remaining[:split_point].strip())
-            remaining = remaining[split_point:].strip()
+            chunks.append(text[pos:split_point].strip())
+            # Skip the whitespace around the remainder (what .strip() used to drop)
+            end = stripped_end
+            pos = split_point
+            while pos < end and text[pos].isspace():
+                pos += 1
         
-        if remaining:
-            chunks.append(remaining)
+        if pos < end:
+            chunks.append(text[pos:end])
         
         return chunks
     
@@ -88,26 +99,29 @@ def create_chunks_from_sections(
     docs, metas, ids = [], [], []
     
     for header, content in sections.items():
-        if not content.strip():
+        # Filter: Skip very short sections first (cheapest test, and covers most empty ones)
+        if len(content) < 100:
             continue
         
-        # Filter: Skip low-value sections
-        if header.lower().strip() in SKIP_SECTIONS:
+        # Filter: Skip low-value and whitespace-only sections
+        if header.strip().lower() in _SKIP_SECTIONS or content.isspace():
             continue
         
-        # Filter: Skip very short sections
-        if len(content) < 100:
-            continue
+        # All chunks of a section share one (read-only) metadata dict. "_header" is the
+        # citation header RagPipeline puts above each chunk, formatted once at ingest.
+        section_meta = {**base_meta, "section": header, "_header": f"[{base_meta['title']} | {header}]"}
+        # Chunk-id prefixes are fixed per section, so build them once
+        header_slug = header.replace(' ', '_')
+        part_prefix = f"{parent_id}#{header_slug[:30]}_part"
         
         # Size control: Split large sections
         if len(content) <= max_chunk_size:
             # Section fits in one chunk
-            chunk_id = f"{parent_id}#{header.replace(' ', '_')[:50]}"
-            chunk_meta = {**base_meta, "section": header}
+            chunk_id = f"{parent_id}#{header_slug[:50]}"
             chunk_content = content.replace("\n", " ")
             
             docs.append(chunk_content)
-            metas.append(chunk_meta)
+            metas.append(section_meta)
             ids.append(chunk_id)
         else:
             # Split large section into multiple chunks
@@ -128,11 +142,9 @@ def create_chunks_from_sections(
                     # Save any accumulated content first
                     if current_chunk:
                         chunk_text = "\n\n".join(current_chunk)
-                        chunk_id = f"{parent_id}#{header.replace(' ', '_')[:30]}_part{sub_chunk_idx}"
-                        chunk_meta = {**base_meta, "section": header}
-                        
+                        chunk_id = f"{part_prefix}{sub_chunk_idx}"
                         docs.append(chunk_text.replace("\n", " "))
-                        metas.append(chunk_meta)
+                        metas.append(section_meta)
                         ids.append(chunk_id)
                         
                         current_chunk = []
@@ -143,11 +155,9 @@ def create_chunks_from_sections(
                     para_chunks = _split_text_hard(para, max_chunk_size - overlap_size)
                     
                     for i, para_chunk in enumerate(para_chunks):
-                        chunk_id = f"{parent_id}#{header.replace(' ', '_')[:30]}_part{sub_chunk_idx}"
-                        chunk_meta = {**base_meta, "section": header}
-                        
+                        chunk_id = f"{part_prefix}{sub_chunk_idx}"
                         docs.append(para_chunk.replace("\n", " "))
-                        metas.append(chunk_meta)
+                        metas.append(section_meta)
                         ids.append(chunk_id)
                         
                         sub_chunk_idx += 1
@@ -166,11 +176,9 @@ def create_chunks_from_sections(
                 if current_size + para_size > max_chunk_size and current_chunk:
                     # Save current chunk
                     chunk_text = "\n\n".join(current_chunk)
-                    chunk_id = f"{parent_id}#{header.replace(' ', '_')[:30]}_part{sub_chunk_idx}"
-                    chunk_meta = {**base_meta, "section": header}
-                    
+                    chunk_id = f"{part_prefix}{sub_chunk_idx}"
                     docs.append(chunk_text.replace("\n", " "))
-                    metas.append(chunk_meta)
+                    metas.append(section_meta)
                     ids.append(chunk_id)
                     
                     # Overlap: Keep last paragraph for context
@@ -195,11 +203,9 @@ def create_chunks_from_sections(
             # Don't forget the last chunk
             if current_chunk:
                 chunk_text = "\n\n".join(current_chunk)
-                chunk_id = f"{parent_id}#{header.replace(' ', '_')[:30]}_part{sub_chunk_idx}"
-                chunk_meta = {**base_meta, "section": header}
-                
+                chunk_id = f"{part_prefix}{sub_chunk_idx}"
                 docs.append(chunk_text.replace("\n", " "))
-                metas.append(chunk_meta)
+                metas.append(section_meta)
                 ids.append(chunk_id)
     
     return docs, metas, ids
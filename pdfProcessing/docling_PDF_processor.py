@@ -1,8 +1,10 @@
 import re
-from typing import Dict, Any, Tuple
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
 import torch
-from docling.datamodel.base_models import InputFormat
+from docling.datamodel.base_models import ConversionStatus, DocumentStream, InputFormat
 from docling.datamodel.pipeline_options import (
     PdfPipelineOptions,
     AcceleratorOptions,
@@ -55,8 +57,84 @@ class DoclingPDFProcessor:
         # 1. Convert PDF
         result = self.converter.convert(file_path)
 
+        return self._build_output(result.document, zotero_metadata)
+
+    def process_pdfs(
+            self,
+            file_paths: List[str],
+            zotero_metadata: Optional[List[Optional[Dict[str, Any]]]] = None
+    ) -> Iterator[Tuple[str, Dict[str, Any], Dict[str, str]]]:
+        """
+        Batch variant of process_pdf: converts several PDFs in one Docling run, so the
+        layout/OCR models are set up once and documents flow through the converter's
+        pipeline back to back. Results are yielded one PDF at a time, so converted
+        documents are never all held in memory at once.
+
+        Args:
+            file_paths (List[str]): Paths of the PDF files.
+            zotero_metadata (List, optional): Zotero metadata per path (same order), or None entries.
+
+        Returns:
+            Iterator of (file_path, metadata, sections), in the order Docling finishes them.
+            PDFs that fail to convert are reported and skipped instead of aborting the batch.
+        """
+        if zotero_metadata is None:
+            zotero_metadata = [None] * len(file_paths)
+
+        # Results are matched back by their source file, never by position: convert_all
+        # may skip or reorder documents it cannot handle
+        pending = {
+            Path(file_path).resolve(): (file_path, zotero_meta)
+            for file_path, zotero_meta in zip(file_paths, zotero_metadata)
+        }
+
+        # 1. Convert all PDFs (lazily, one result at a time)
+        for result in self.converter.convert_all(file_paths, raises_on_error=False):
+            file_path, zotero_meta = pending.pop(Path(result.input.file).resolve(), (None, None))
+            if file_path is None:
+                print(f"  Warning: Ignoring unexpected Docling result for {result.input.file}")
+                continue
+
+            if result.status not in (ConversionStatus.SUCCESS, ConversionStatus.PARTIAL_SUCCESS):
+                print(f"  Error: Docling could not convert {file_path} ({result.status})")
+                continue
+
+            # 2. Sections and metadata, as in process_pdf
+            metadata, sections = self._build_output(result.document, zotero_meta)
+            yield file_path, metadata, sections
+
+        for file_path, _ in pending.values():
+            print(f"  Error: Docling returned no result for {file_path}")
+
+    def process_bytes(
+            self,
+            data: bytes,
+            filename: str = "document.pdf",
+            zotero_metadata: Dict[str, Any] = None
+    ) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Same as process_pdf, but for a PDF already held in memory (e.g. an upload),
+        so it does not have to be written to a temporary file first.
+
+        Args:
+            data (bytes): The raw PDF content.
+            filename (str): Name reported to Docling (used for format detection).
+            zotero_metadata (Dict, optional): Pre-extracted metadata from Zotero.
+
+        Returns:
+            Tuple[Dict, Dict]: A tuple containing (metadata, sections).
+        """
+        # 1. Convert PDF straight from the buffer
+        result = self.converter.convert(DocumentStream(name=filename, stream=BytesIO(data)))
+
+        return self._build_output(result.document, zotero_metadata)
+
+    def _build_output(self, doc, zotero_metadata: Dict[str, Any] = None) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """
+        Shared tail of process_pdf/process_bytes: sections and metadata from a converted document.
+        """
         # 2. Extract Sections
-        sections = self._extract_sections_from_doc(result.document)
+        sections = self._extract_sections_from_doc(doc)
 
         # 3. Extract Metadata
         metadata = self._extract_metadata(sections, zotero_metadata=zotero_metadata)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from embeddingModels.ModernBertEmbedder import ModernBertEmbedder
+
+
+def test_query_graph_is_opt_in():
+    embedder = ModernBertEmbedder(auto_load=False)
+    assert embedder.query_graph_length == 0
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="CUDA graphs need a GPU")
+def test_query_graph_matches_eager_for_padded_query():
+    embedder = ModernBertEmbedder(model_name="Alibaba-NLP/gte-modernbert-base", query_graph_length=64)
+    if embedder._query_graph is None:
+        pytest.skip("query graph was not captured or failed its check at load time")
+
+    # Far shorter than 64 tokens, so the graph replay runs with padding
+    text = "Bayesian alignment of beamlines"
+    graph_vector = embedder.encode(text)
+
+    graph, embedder._query_graph = embedder._query_graph, None
+    try:
+        eager_vector = embedder.encode(text)
+    finally:
+        embedder._query_graph = graph
+
+    np.testing.assert_allclose(graph_vector, eager_vector, atol=1e-3)
@@ -0,0 +1,33 @@
+import httpx
+
+from backend import utils
+from backend.services import recommendation
+from backend.services.recommendation import SemanticScholarService
+
+
+def test_sync_online_search_closes_its_client(monkeypatch):
+    created = []
+
+    class RecordingClient(httpx.AsyncClient):
+        def __init__(self, **kwargs):
+            kwargs.pop("http2", None)
+            super().__init__(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})), **kwargs)
+            created.append(self)
+
+    monkeypatch.setattr(recommendation.httpx, "AsyncClient", RecordingClient)
+
+    service = SemanticScholarService(api_key="test")
+
+    async def fake_smart_search(query, limit=1):
+        await service._get_client().get("https://api.semanticscholar.org/graph/v1/paper/search")
+        return [{"title": "Paper", "year": 2024, "url": "https://example.org", "abstract": "Abstract"}]
+
+    monkeypatch.setattr(service, "smart_search", fake_smart_search)
+
+    for _ in range(2):
+        text = utils.perform_online_search_sync(service, "query", top_k=1)
+        assert "Paper" in text
+
+    assert len(created) == 2
+    assert all(client.is_closed for client in created)
+    assert not service._clients